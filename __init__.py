@@ -1,6 +1,7 @@
 from .py.color_adjustment import ColorAdjustment
 from .py.image_cropper import ImageCropper
 from .py.text_image import NODE_CLASS_MAPPINGS as TEXT_IMAGE_NODES
+from .py import metrics  # 注册 /zero_tools/metrics 和 /zero_tools/trace 路由
 
 # 定义web目录
 WEB_DIRECTORY = "./web"
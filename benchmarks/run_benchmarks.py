@@ -0,0 +1,287 @@
+"""
+tools_zero 性能基准
+
+不依赖ComfyUI运行，输出JSON或CSV便于按版本对比:
+
+    python benchmarks/run_benchmarks.py --format csv --output bench.csv
+    python benchmarks/run_benchmarks.py --quick
+"""
+import argparse
+import base64
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from stub_server import REPO_ROOT, SimulatedClient, StubRequest, install
+
+PREVIEW_SIZES = {
+    "512": (512, 512),
+    "1080p": (1080, 1920),
+    "4K": (2160, 3840),
+    "8K": (4320, 7680),
+}
+QUICK_PREVIEW_SIZES = ("512", "1080p")
+
+
+def measure(fn, repeat, warmup=1):
+    """运行fn并返回耗时统计（毫秒），fn的标准输出被丢弃"""
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+    }
+
+
+def pick_font():
+    font_dir = os.path.join(REPO_ROOT, "fonts")
+    if os.path.isdir(font_dir):
+        for file in sorted(os.listdir(font_dir)):
+            if file.lower().endswith((".ttf", ".otf")):
+                return file
+    # 字体缺失时节点会回退到PIL默认字体
+    return "Arial.ttf"
+
+
+def bench_text_image(package, repeat, quick):
+    TextImage = package.NODE_CLASS_MAPPINGS["文本图像"]
+    node = TextImage()
+    font_file = pick_font()
+    sample = "The quick brown fox jumps over the lazy dog. "
+    lengths = (10, 100) if quick else (10, 100, 1000)
+    variations = (0, 30)
+    canvases = (512,) if quick else (512, 2048)
+
+    results = []
+    for length in lengths:
+        text = (sample * (length // len(sample) + 1))[:length]
+        # 每40个字符换行，避免单行过长
+        text = "\n".join(text[i:i + 40] for i in range(0, len(text), 40))
+        for variation in variations:
+            for canvas in canvases:
+                def run():
+                    node.text_image(text, font_file, 0, 0, 0, 0, 80.0, variation, 1234, "horizontal",
+                                    canvas, canvas, "#000000", "#FFFFFF", "center", "center")
+                results.append({
+                    "benchmark": "text_image",
+                    "params": f"chars={length} variation={variation} canvas={canvas}",
+                    **measure(run, repeat),
+                })
+
+    frames = 10 if quick else 60
+    def run_sequence():
+        node.text_image("Title", font_file, 0, 0, 0, 0, 80.0, 10, 1234, "horizontal", 512, 512,
+                        "#000000", "#FFFFFF", "center", "center",
+                        frame_count=frames, keyframes=f"0: x_offset=-100\n{frames - 1}: x_offset=100")
+    results.append({
+        "benchmark": "text_image_sequence",
+        "params": f"frames={frames} canvas=512",
+        **measure(run_sequence, repeat),
+    })
+    return results
+
+
+def bench_preview_encode(package, repeat, quick):
+    color = sys.modules[f"{package.__name__}.py.tools_zero_core.color"]
+    crop = sys.modules[f"{package.__name__}.py.tools_zero_core.crop"]
+    sizes = QUICK_PREVIEW_SIZES if quick else PREVIEW_SIZES.keys()
+
+    results = []
+    for name in sizes:
+        height, width = PREVIEW_SIZES[name]
+        frame = torch.rand(height, width, 3)
+        results.append({
+            "benchmark": "color_preview_encode",
+            "params": f"size={name}",
+            **measure(lambda: color.encode_preview(frame), repeat),
+        })
+
+        # 裁剪预览：首个（最顶层）瓦片的延迟，每次都重新构建金字塔
+        def first_tile():
+            pyramid = crop.TilePyramid(frame)
+            pyramid.tile_png(pyramid.levels - 1, 0, 0)
+        results.append({
+            "benchmark": "cropper_first_tile",
+            "params": f"size={name}",
+            **measure(first_tile, repeat),
+        })
+    return results
+
+
+def bench_apply_routes(package, client, repeat, quick):
+    color_adjustment = sys.modules[f"{package.__name__}.py.color_adjustment"]
+    image_cropper = sys.modules[f"{package.__name__}.py.image_cropper"]
+    sizes = QUICK_PREVIEW_SIZES if quick else ("512", "1080p", "4K")
+
+    results = []
+    for name in sizes:
+        height, width = PREVIEW_SIZES[name]
+        rgba = np.random.randint(0, 256, size=(height, width, 4), dtype=np.uint8)
+
+        # 颜色调整：前端提交的是原始RGBA字节
+        adjusted_data = rgba.tobytes()
+        def color_apply():
+            color_adjustment.node_data["bench"] = {
+                "event": color_adjustment.Event(),
+                "result": None,
+                "shape": (1, height, width, 3),
+            }
+            client.call("POST", "/zero_color_adjustment/apply",
+                        StubRequest(adjusted_data, query={"node_id": "bench"},
+                                    headers={"Content-Type": "application/octet-stream"}))
+        results.append({
+            "benchmark": "color_apply_decode",
+            "params": f"size={name}",
+            **measure(color_apply, repeat),
+        })
+        color_adjustment.node_data.pop("bench", None)
+
+        # 图像裁剪：上传base64 PNG的解码路径
+        buffer = io.BytesIO()
+        Image.fromarray(rgba[..., :3]).save(buffer, format="PNG")
+        cropped_data = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+        def cropper_apply():
+            image_cropper.crop_node_data.pop("bench", None)
+            client.call("POST", "/zero_image_cropper/apply", StubRequest({
+                "node_id": "bench", "x": 0, "y": 0, "width": width, "height": height,
+                "cropped_data_base64": cropped_data,
+            }))
+        results.append({
+            "benchmark": "cropper_apply_decode",
+            "params": f"size={name}",
+            **measure(cropper_apply, repeat),
+        })
+        image_cropper.crop_node_data.pop("bench", None)
+    return results
+
+
+def bench_sessions(package, repeat, quick):
+    """完整节点执行，由模拟客户端应答"""
+    ColorAdjustment = package.NODE_CLASS_MAPPINGS["Zero_ColorAdjustment"]
+    ImageCropper = package.NODE_CLASS_MAPPINGS["Zero_ImageCropper"]
+    sizes = ("512",) if quick else ("512", "1080p")
+
+    results = []
+    for name in sizes:
+        height, width = PREVIEW_SIZES[name]
+        image = torch.rand(1, height, width, 3)
+        results.append({
+            "benchmark": "color_adjustment_session",
+            "params": f"size={name}",
+            **measure(lambda: ColorAdjustment().adjust(image, unique_id="session"), repeat),
+        })
+        results.append({
+            "benchmark": "image_cropper_session",
+            "params": f"size={name}",
+            **measure(lambda: ImageCropper().crop(image, unique_id="session"), repeat),
+        })
+
+    # 关键帧调色：整批逐帧参数一次执行完成，不需要前端应答
+    frames = 10 if quick else 100
+    batch = torch.rand(frames, 270, 480, 3)
+    keyframes = f"0: brightness=1.0, temperature=1.0\n{frames - 1}: brightness=1.4, temperature=1.3, hue=1.2"
+    results.append({
+        "benchmark": "color_keyframes",
+        "params": f"frames={frames} size=480x270",
+        **measure(lambda: ColorAdjustment().adjust(batch, unique_id="keyframes", keyframes=keyframes), repeat),
+    })
+    return results
+
+
+def bench_core_import(repeat):
+    """在新进程中导入计算核心的耗时（不加载ComfyUI和torch）"""
+    code = ("import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); "
+            "from tools_zero_core import text_layout, keyframes, glyph_index, color, crop; "
+            "print((time.perf_counter() - start) * 1000)")
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code, os.path.join(REPO_ROOT, "py")],
+                                check=True, capture_output=True, text=True).stdout
+        timings.append(float(output.strip()))
+    return [{
+        "benchmark": "core_import",
+        "params": "fresh process",
+        "repeat": repeat,
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+    }]
+
+
+def write_results(results, output, fmt):
+    stream = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    try:
+        if fmt == "csv":
+            writer = csv.DictWriter(stream, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump({
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "platform": platform.platform(),
+                "results": results,
+            }, stream, indent=2, ensure_ascii=False)
+            stream.write("\n")
+    finally:
+        if output:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tools_zero 性能基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--quick", action="store_true", help="只运行小尺寸用例")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--output", help="输出文件，默认输出到标准输出")
+    parser.add_argument("--only", choices=("import", "text", "preview", "apply", "session"), action="append",
+                        help="只运行指定分组，可重复")
+    args = parser.parse_args()
+
+    package, server = install()
+    client = SimulatedClient(server)
+    groups = args.only or ("import", "text", "preview", "apply", "session")
+
+    results = []
+    try:
+        if "import" in groups:
+            results += bench_core_import(args.repeat)
+        if "text" in groups:
+            results += bench_text_image(package, args.repeat, args.quick)
+        if "preview" in groups:
+            results += bench_preview_encode(package, args.repeat, args.quick)
+        if "apply" in groups:
+            results += bench_apply_routes(package, client, args.repeat, args.quick)
+        if "session" in groups:
+            results += bench_sessions(package, args.repeat, args.quick)
+    finally:
+        client.close()
+
+    write_results(results, args.output, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+ComfyUI PromptServer 的本地替身，用于在没有ComfyUI的环境下导入并运行节点
+
+install() 会注册一个假的 server 模块，然后以 tools_zero 包名加载仓库，
+SimulatedClient 在后台事件循环中模拟前端应答节点的交互会话。
+"""
+import asyncio
+import importlib.util
+import io
+import os
+import sys
+import threading
+import types
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PACKAGE_NAME = "tools_zero"
+
+
+class StubPromptServer:
+    """只实现节点用到的部分：routes 路由表和 send_sync 消息推送"""
+
+    instance = None
+
+    def __init__(self):
+        self.routes = web.RouteTableDef()
+        self.listeners = []
+        self.client_id = None
+        self.last_prompt_id = None
+
+    def send_sync(self, event, data, sid=None):
+        for listener in list(self.listeners):
+            listener(event, data, sid)
+
+    def handler(self, method, path):
+        for route in self.routes:
+            if route.method == method and route.path == path:
+                return route.handler
+        raise KeyError(f"路由未注册: {method} {path}")
+
+
+class StubRequest:
+    """路由处理函数用到的 aiohttp 请求接口子集"""
+
+    def __init__(self, data=None, query=None, headers=None):
+        self._data = data
+        self.query = query or {}
+        self.headers = headers or {"Content-Type": "application/json"}
+        self.content_type = self.headers.get("Content-Type", "application/octet-stream")
+        self.content_length = len(data) if isinstance(data, bytes) else None
+
+    async def json(self):
+        return self._data
+
+    async def read(self):
+        return self._data
+
+
+def install():
+    """注册假的 server 模块并加载节点包，返回 (包模块, StubPromptServer实例)"""
+    if StubPromptServer.instance is None:
+        StubPromptServer.instance = StubPromptServer()
+        server_module = types.ModuleType("server")
+        server_module.PromptServer = StubPromptServer
+        sys.modules["server"] = server_module
+
+    if PACKAGE_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME, os.path.join(REPO_ROOT, "__init__.py"),
+            submodule_search_locations=[REPO_ROOT])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE_NAME] = package
+        spec.loader.exec_module(package)
+    return sys.modules[PACKAGE_NAME], StubPromptServer.instance
+
+
+class SimulatedClient:
+    """
+    模拟浏览器应答节点会话
+
+    收到 zero_color_adjustment_update 时以二进制获取预览、解码后原样提交RGBA字节；
+    收到 zero_image_cropper_update 时请求顶层瓦片并提交中心区域的裁剪坐标。
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.handlers = {
+            "zero_color_adjustment_update": self.answer_color_adjustment,
+            "zero_image_cropper_update": self.answer_image_cropper,
+        }
+        server.listeners.append(self.on_message)
+
+    def on_message(self, event, data, sid):
+        handler = self.handlers.get(event)
+        if handler is not None:
+            asyncio.run_coroutine_threadsafe(handler(data), self.loop)
+
+    def call(self, method, path, request):
+        """在后台事件循环中调用路由并等待结果"""
+        handler = self.server.handler(method, path)
+        return asyncio.run_coroutine_threadsafe(handler(request), self.loop).result()
+
+    async def answer_color_adjustment(self, data):
+        preview_handler = self.server.handler("GET", "/zero_color_adjustment/preview")
+        response = await preview_handler(StubRequest(query={"node_id": data["node_id"]}))
+        pixels = np.array(Image.open(io.BytesIO(response.body)).convert("RGBA"))
+        handler = self.server.handler("POST", "/zero_color_adjustment/apply")
+        await handler(StubRequest(pixels.tobytes(), query={"node_id": data["node_id"]},
+                                  headers={"Content-Type": "application/octet-stream"}))
+
+    async def answer_image_cropper(self, data):
+        tile_handler = self.server.handler("GET", "/zero_image_cropper/tile")
+        await tile_handler(StubRequest(query={
+            "node_id": data["node_id"], "session": data["session"],
+            "level": str(data["levels"] - 1), "x": "0", "y": "0"}))
+        handler = self.server.handler("POST", "/zero_image_cropper/apply")
+        await handler(StubRequest({
+            "node_id": data["node_id"],
+            "x": data["width"] // 4,
+            "y": data["height"] // 4,
+            "width": data["width"] // 2,
+            "height": data["height"] // 2,
+        }))
+
+    def close(self):
+        self.server.listeners.remove(self.on_message)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -1,13 +1,13 @@
-import torch
-import numpy as np
 from server import PromptServer
 from threading import Event
 from aiohttp import web
-import json
-import base64
-import io
-from PIL import Image
 import traceback
+import asyncio
+from .tools_zero_core.color import (COLOR_PARAMS, compute_statistics, encode_preview, prepare_mask, decode_rgba,
+                                    blend_region, adjust_colors)
+from .tools_zero_core.keyframes import parse_keyframes, interpolate_keyframes
+from .tools_zero_core.metrics import registry, traces, prompt_context, span
+from .execution import current_prompt_id
 
 # 使用简单的字典存储节点状态
 node_data = {}
@@ -15,6 +15,8 @@ node_data = {}
 # 全局变量用于存储裁剪节点数据
 crop_node_data = {}
 
+registry.gauge("tools_zero_live_sessions", lambda: len(node_data), node="ColorAdjustment")
+
 class ColorAdjustment:
     """颜色调整节点"""
     
@@ -24,6 +26,11 @@ class ColorAdjustment:
             "required": {
                 "image": ("IMAGE",),
             },
+            "optional": {
+                "mask": ("MASK",),
+                "feather": ("INT", {"default": 0, "min": 0, "max": 512, "step": 1}),
+                "keyframes": ("STRING", {"multiline": True, "default": ""}),
+            },
             "hidden": {
                 "unique_id": "UNIQUE_ID",
             }
@@ -34,36 +41,86 @@ class ColorAdjustment:
     CATEGORY = "tools_zero"
     OUTPUT_NODE = True
 
-    def adjust(self, image, unique_id=None):
+    def adjust(self, image, unique_id=None, mask=None, feather=0, keyframes=""):
+        """
+        实时调整颜色；keyframes 非空时不等待前端，直接按关键帧逐帧调整整批图像
+
+        keyframes 每行一个，如 "0: brightness=1.0, temperature=1.2"，参数取值与滑块一致，
+        未出现的参数为1.0（不调整），帧之间线性插值
+        """
+        prompt_id = current_prompt_id()
+        with prompt_context(prompt_id):
+            # 关键帧格式错误或遮罩批次不匹配时直接报错，不回退为原图
+            tracks = parse_keyframes(keyframes, COLOR_PARAMS)
+            box, alpha = None, None
+            if mask is not None:
+                with span("ColorAdjustment", "mask"):
+                    box, alpha = prepare_mask(mask, image.shape[1], image.shape[2], feather, image.shape[0])
+            if mask is not None and box is None:
+                print("[ColorAdjustment] 遮罩为空，跳过调整")
+                result = (image,)
+            else:
+                result = self._adjust(image, unique_id, box, alpha, tracks)
+        traces.dump(prompt_id)
+        return result
+
+    def _adjust(self, image, unique_id=None, box=None, alpha=None, tracks=None):
+        node_id = unique_id
         try:
-            node_id = unique_id
+            # 有遮罩时只把遮罩包围盒内的区域交给前端调整，再按遮罩混合回原图
+            region = image
+            if box is not None:
+                x0, y0, x1, y1 = box
+                region = image[:, y0:y1, x0:x1, :]
+
+            if tracks:
+                with span("ColorAdjustment", "grade", frames=region.shape[0]):
+                    frames = interpolate_keyframes(tracks, dict.fromkeys(COLOR_PARAMS, 1.0), region.shape[0])
+                    adjusted = adjust_colors(region, frames)
+                    if box is None:
+                        return (adjusted,)
+                    return (blend_region(image, box, alpha, adjusted),)
+
             event = Event()
             node_data[node_id] = {
                 "event": event,
                 "result": None,
-                "shape": image.shape
+                "shape": region.shape,
+                "preview": None,
+                "region": region,  # 统计信息在前端请求自动调整时才计算
+                "statistics": None
             }
             
-            preview_image = (torch.clamp(image.clone(), 0, 1) * 255).cpu().numpy().astype(np.uint8)[0]
-            pil_image = Image.fromarray(preview_image)
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format="PNG")
-            base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            with span("ColorAdjustment", "preview_encode"):
+                node_data[node_id]["preview"] = encode_preview(region[0])
             
             try:
-                PromptServer.instance.send_sync("zero_color_adjustment_update", {
-                    "node_id": node_id,
-                    "image_data": f"data:image/png;base64,{base64_image}"
-                })
+                # 只通知提交该prompt的客户端，预览PNG由前端通过 /zero_color_adjustment/preview 以二进制获取
+                with span("ColorAdjustment", "push"):
+                    PromptServer.instance.send_sync("zero_color_adjustment_update", {
+                        "node_id": node_id,
+                        "width": region.shape[2],
+                        "height": region.shape[1]
+                    }, PromptServer.instance.client_id)
                 
-                if not event.wait(timeout=5):
+                with span("ColorAdjustment", "wait"):
+                    answered = event.wait(timeout=5)
+                if not answered:
+                    registry.inc("tools_zero_timeouts_total", node="ColorAdjustment")
                     if node_id in node_data:
                         del node_data[node_id]
                     return (image,)
 
                 result_image = node_data[node_id]["result"]
                 del node_data[node_id]
-                return (result_image if result_image is not None else image,)
+                if result_image is None:
+                    return (image,)
+                if box is None:
+                    return (result_image,)
+
+                # 只在区域内混合，区域外保持原图
+                with span("ColorAdjustment", "blend"):
+                    return (blend_region(image, box, alpha, result_image),)
                 
             except Exception as e:
                 if node_id in node_data:
@@ -78,9 +135,17 @@ class ColorAdjustment:
 @PromptServer.instance.routes.post("/zero_color_adjustment/apply")
 async def apply_color_adjustment(request):
     try:
-        data = await request.json()
-        node_id = data.get("node_id")
-        adjusted_data = data.get("adjusted_data")
+        with span("ColorAdjustment", "parse", current_prompt_id()):
+            if request.content_type == "application/octet-stream":
+                # 二进制请求：请求体为原始RGBA字节，node_id在查询参数中
+                node_id = request.query.get("node_id")
+                adjusted_data = await request.read()
+            else:
+                data = await request.json()
+                node_id = data.get("node_id")
+                adjusted_data = data.get("adjusted_data")
+        if request.content_length:
+            registry.inc("tools_zero_bytes_received_total", request.content_length, node="ColorAdjustment")
         
         if node_id not in node_data:
             return web.json_response({"success": False, "error": "节点数据不存在"})
@@ -88,13 +153,10 @@ async def apply_color_adjustment(request):
         try:
             node_info = node_data[node_id]
             
-            if isinstance(adjusted_data, list):
-                batch, height, width, channels = node_info["shape"]
-                
-                if len(adjusted_data) >= height * width * 4:
-                    rgba_array = np.array(adjusted_data, dtype=np.uint8).reshape(height, width, 4)
-                    rgb_array = rgba_array[:, :, :3]
-                    tensor_image = torch.from_numpy(rgb_array / 255.0).float().reshape(batch, height, width, channels)
+            if isinstance(adjusted_data, (list, bytes)):
+                with span("ColorAdjustment", "decode", current_prompt_id()):
+                    tensor_image = decode_rgba(adjusted_data, node_info["shape"])
+                if tensor_image is not None:
                     node_info["result"] = tensor_image
             
             node_info["event"].set()
@@ -108,6 +170,41 @@ async def apply_color_adjustment(request):
     except Exception as e:
         return web.json_response({"success": False, "error": str(e)})
 
+@PromptServer.instance.routes.get("/zero_color_adjustment/preview")
+async def get_color_preview(request):
+    try:
+        node_id = request.query.get("node_id")
+        node_info = node_data.get(node_id)
+        if node_info is None or node_info.get("preview") is None:
+            return web.json_response({"success": False, "error": "节点数据不存在"}, status=404)
+        
+        data = node_info["preview"]
+        registry.inc("tools_zero_bytes_sent_total", len(data), node="ColorAdjustment")
+        return web.Response(body=data, content_type="image/png",
+                            headers={"Cache-Control": "no-store"})
+    
+    except Exception as e:
+        return web.json_response({"success": False, "error": str(e)}, status=500)
 
+@PromptServer.instance.routes.post("/zero_color_adjustment/statistics")
+async def get_color_statistics(request):
+    try:
+        data = await request.json()
+        node_id = data.get("node_id")
+
+        node_info = node_data.get(node_id)
+        if node_info is None:
+            return web.json_response({"success": False, "error": "节点统计信息不存在"})
+
+        # 首次请求时在线程池中计算并缓存，会话结束时随节点数据一起释放
+        statistics = node_info.get("statistics")
+        if statistics is None:
+            loop = asyncio.get_running_loop()
+            with span("ColorAdjustment", "statistics", current_prompt_id()):
+                statistics = await loop.run_in_executor(None, compute_statistics, node_info["region"])
+            node_info["statistics"] = statistics
 
+        return web.json_response({"success": True, **statistics})
 
+    except Exception as e:
+        return web.json_response({"success": False, "error": str(e)})
@@ -0,0 +1,9 @@
+"""执行上下文查询，导入时不依赖ComfyUI、不注册路由"""
+
+def current_prompt_id():
+    """当前正在执行的prompt_id，不在ComfyUI中运行或取不到时返回None"""
+    try:
+        from server import PromptServer
+    except ImportError:
+        return None
+    return getattr(PromptServer.instance, "last_prompt_id", None)
@@ -1,17 +1,23 @@
 import torch
-import numpy as np
 from server import PromptServer
 from threading import Event
 from aiohttp import web
-import json
 import base64
-import io
-from PIL import Image
 import traceback
+import asyncio
+import uuid
+from .tools_zero_core.crop import TilePyramid, TileCache, crop_tensors, decode_crop_upload
+from .tools_zero_core.metrics import registry, traces, prompt_context, span
+from .execution import current_prompt_id
 
 # 全局变量用于存储裁剪节点数据
 crop_node_data = {}
 
+# 预览瓦片缓存
+tile_cache = TileCache()
+
+registry.gauge("tools_zero_live_sessions", lambda: len(crop_node_data), node="ImageCropper")
+
 class ImageCropper:
     """图像裁剪专用节点"""
     
@@ -36,10 +42,25 @@ class ImageCropper:
     OUTPUT_NODE = True
 
     def crop(self, image, unique_id, mask=None):
+        prompt_id = current_prompt_id()
+        # 每次执行一个会话令牌，瓦片按令牌缓存，同一节点的下次执行不会取到旧图像的瓦片
+        session = uuid.uuid4().hex
+        tile_cache.open(session)
+        try:
+            with prompt_context(prompt_id):
+                return self._crop(image, unique_id, mask, session)
+        finally:
+            tile_cache.release(session)
+            traces.dump(prompt_id)
+
+    def _crop(self, image, unique_id, mask=None, session=None):
         try:
             node_id = unique_id
             event = Event()
             
+            with span("ImageCropper", "pyramid"):
+                pyramid = TilePyramid(image[0])  # 预览瓦片金字塔，按需生成
+            
             # 初始化节点数据
             crop_node_data[node_id] = {
                 "event": event,
@@ -48,24 +69,28 @@ class ImageCropper:
                 "processing_complete": False,
                 "original_mask": mask,  # 存储原始遮罩
                 "original_image": image,  # 存储原始图像
-                "crop_info": None  # 存储裁剪信息(x, y, width, height)
+                "crop_info": None,  # 存储裁剪信息(x, y, width, height)
+                "pyramid": pyramid,
+                "session": session
             }
             
-            # 发送预览图像
-            preview_image = (torch.clamp(image.clone(), 0, 1) * 255).cpu().numpy().astype(np.uint8)[0]
-            pil_image = Image.fromarray(preview_image)
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format="PNG")
-            base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
             try:
-                PromptServer.instance.send_sync("zero_image_cropper_update", {
-                    "node_id": node_id,
-                    "image_data": f"data:image/png;base64,{base64_image}"
-                })
+                # 只向提交该prompt的客户端发送图像尺寸和金字塔信息，前端按可见区域以二进制请求瓦片
+                with span("ImageCropper", "push"):
+                    PromptServer.instance.send_sync("zero_image_cropper_update", {
+                        "node_id": node_id,
+                        "session": session,
+                        "width": pyramid.width,
+                        "height": pyramid.height,
+                        "tile_size": pyramid.tile_size,
+                        "levels": pyramid.levels
+                    }, PromptServer.instance.client_id)
                 
                 # 等待前端裁剪完成
-                if not event.wait(timeout=30):
+                with span("ImageCropper", "wait"):
+                    answered = event.wait(timeout=30)
+                if not answered:
+                    registry.inc("tools_zero_timeouts_total", node="ImageCropper")
                     print(f"[ImageCropper] 等待超时: 节点ID {node_id}")
                     if node_id in crop_node_data:
                         del crop_node_data[node_id]
@@ -111,6 +136,9 @@ async def apply_image_cropper(request):
         # 检查内容类型
         content_type = request.headers.get('Content-Type', '')
         print(f"[ImageCropper] 请求内容类型: {content_type}")
+        prompt_id = current_prompt_id()
+        if request.content_length:
+            registry.inc("tools_zero_bytes_received_total", request.content_length, node="ImageCropper")
         
         node_id = None
         crop_width = None
@@ -119,44 +147,45 @@ async def apply_image_cropper(request):
         crop_x = 0  # 裁剪起始X坐标
         crop_y = 0  # 裁剪起始Y坐标
         
-        if 'multipart/form-data' in content_type:
-            # 处理multipart/form-data请求
-            reader = await request.multipart()
+        with span("ImageCropper", "parse", prompt_id):
+            if 'multipart/form-data' in content_type:
+                # 处理multipart/form-data请求
+                reader = await request.multipart()
             
-            # 读取表单字段
-            while True:
-                part = await reader.next()
-                if part is None:
-                    break
+                # 读取表单字段
+                while True:
+                    part = await reader.next()
+                    if part is None:
+                        break
                 
-                if part.name == 'node_id':
-                    node_id = await part.text()
-                elif part.name == 'width':
-                    crop_width = int(await part.text())
-                elif part.name == 'height':
-                    crop_height = int(await part.text())
-                elif part.name == 'x':
-                    crop_x = int(await part.text())
-                elif part.name == 'y':
-                    crop_y = int(await part.text())
-                elif part.name == 'image_data':
-                    image_data = await part.read(decode=False)
-        else:
-            # 处理JSON请求
-            data = await request.json()
-            node_id = data.get("node_id")
-            crop_width = data.get("width")
-            crop_height = data.get("height")
-            crop_x = data.get("x", 0)
-            crop_y = data.get("y", 0)
+                    if part.name == 'node_id':
+                        node_id = await part.text()
+                    elif part.name == 'width':
+                        crop_width = int(await part.text())
+                    elif part.name == 'height':
+                        crop_height = int(await part.text())
+                    elif part.name == 'x':
+                        crop_x = int(await part.text())
+                    elif part.name == 'y':
+                        crop_y = int(await part.text())
+                    elif part.name == 'image_data':
+                        image_data = await part.read(decode=False)
+            else:
+                # 处理JSON请求
+                data = await request.json()
+                node_id = data.get("node_id")
+                crop_width = data.get("width")
+                crop_height = data.get("height")
+                crop_x = data.get("x", 0)
+                crop_y = data.get("y", 0)
             
-            cropped_data_base64 = data.get("cropped_data_base64")
-            if cropped_data_base64:
-                if cropped_data_base64.startswith('data:image'):
-                    base64_data = cropped_data_base64.split(',')[1]
-                else:
-                    base64_data = cropped_data_base64
-                image_data = base64.b64decode(base64_data)
+                cropped_data_base64 = data.get("cropped_data_base64")
+                if cropped_data_base64:
+                    if cropped_data_base64.startswith('data:image'):
+                        base64_data = cropped_data_base64.split(',')[1]
+                    else:
+                        base64_data = cropped_data_base64
+                    image_data = base64.b64decode(base64_data)
         
         if node_id not in crop_node_data:
             crop_node_data[node_id] = {
@@ -180,65 +209,22 @@ async def apply_image_cropper(request):
                 "height": crop_height
             }
             
+            box = (crop_x, crop_y, crop_width, crop_height)
             if image_data:
                 try:
-                    buffer = io.BytesIO(image_data)
-                    pil_image = Image.open(buffer)
-                    
-                    if pil_image.mode == 'RGBA':
-                        pil_image = pil_image.convert('RGB')
-                    
-                    np_image = np.array(pil_image)
-                    
-                    if len(np_image.shape) == 3 and np_image.shape[2] == 3:
-                        tensor_image = torch.from_numpy(np_image / 255.0).float().unsqueeze(0)
-                        node_info["result"] = tensor_image
-                        
-                        # 处理遮罩裁剪
-                        original_mask = node_info.get("original_mask")
-                        if original_mask is not None:
-                            # 获取原始图像尺寸
-                            original_image = node_info.get("original_image")
-                            if original_image is not None:
-                                orig_height = original_image.shape[1]
-                                orig_width = original_image.shape[2]
-                                
-                                # 确保遮罩与原始图像尺寸匹配
-                                if original_mask.shape[1] == orig_height and original_mask.shape[2] == orig_width:
-                                    # 确保裁剪坐标在有效范围内
-                                    valid_x = min(max(0, crop_x), orig_width - 1)
-                                    valid_y = min(max(0, crop_y), orig_height - 1)
-                                    valid_width = min(crop_width, orig_width - valid_x)
-                                    valid_height = min(crop_height, orig_height - valid_y)
-                                    
-                                    # 裁剪遮罩
-                                    if valid_width > 0 and valid_height > 0:
-                                        # 直接裁剪遮罩
-                                        cropped_mask = original_mask[:, valid_y:valid_y+valid_height, valid_x:valid_x+valid_width]
-                                        
-                                        # 确保遮罩尺寸与图像一致
-                                        if tensor_image.shape[1] != cropped_mask.shape[1] or tensor_image.shape[2] != cropped_mask.shape[2]:
-                                            print(f"[ImageCropper] 调整遮罩尺寸以匹配图像: 遮罩={cropped_mask.shape}, 图像={tensor_image.shape}")
-                                            # 调整遮罩尺寸以匹配图像
-                                            cropped_mask = torch.nn.functional.interpolate(
-                                                cropped_mask.unsqueeze(1),  # 添加通道维度 [B, 1, H, W]
-                                                size=(tensor_image.shape[1], tensor_image.shape[2]),
-                                                mode="nearest"
-                                            ).squeeze(1)  # 移除通道维度 [B, H, W]
-                                        
-                                        node_info["result_mask"] = cropped_mask
-                                    else:
-                                        print(f"[ImageCropper] 警告: 裁剪区域无效: x={valid_x}, y={valid_y}, width={valid_width}, height={valid_height}")
-                                else:
-                                    print(f"[ImageCropper] 警告: 遮罩尺寸与原始图像不匹配: 遮罩={original_mask.shape}, 图像={original_image.shape}")
-                        
-                        node_info["event"].set()
-                    else:
-                        print(f"[ImageCropper] 警告: 图像数组形状不符合预期: {np_image.shape}")
+                    with span("ImageCropper", "decode", prompt_id):
+                        node_info["result"], node_info["result_mask"] = decode_crop_upload(
+                            image_data, node_info.get("original_image"), node_info.get("original_mask"), box)
                 except Exception as e:
                     print(f"[ImageCropper] 处理图像数据时出错: {str(e)}")
                     traceback.print_exc()
-                    node_info["event"].set()
+                node_info["event"].set()
+            elif node_info.get("original_image") is not None and crop_width and crop_height:
+                # 瓦片预览模式下前端只提交裁剪坐标，直接在原图张量上裁剪
+                with span("ImageCropper", "crop", prompt_id):
+                    node_info["result"], node_info["result_mask"] = crop_tensors(
+                        node_info["original_image"], node_info.get("original_mask"), box)
+                node_info["event"].set()
             
             return web.json_response({"success": True})
             
@@ -254,6 +240,35 @@ async def apply_image_cropper(request):
         traceback.print_exc()
         return web.json_response({"success": False, "error": str(e)})
 
+@PromptServer.instance.routes.get("/zero_image_cropper/tile")
+async def get_image_cropper_tile(request):
+    try:
+        node_id = request.query.get("node_id")
+        session = request.query.get("session")
+        level = int(request.query.get("level", 0))
+        x = int(request.query.get("x", 0))
+        y = int(request.query.get("y", 0))
+        
+        node_info = crop_node_data.get(node_id)
+        if node_info is None or node_info.get("pyramid") is None or node_info.get("session") != session:
+            return web.json_response({"success": False, "error": "节点未找到"}, status=404)
+        
+        # 瓦片编码在线程池中执行，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        with span("ImageCropper", "tile", current_prompt_id(), level=level, x=x, y=y):
+            data = await loop.run_in_executor(None, tile_cache.get, session, node_info["pyramid"], level, x, y)
+        if data is None:
+            return web.json_response({"success": False, "error": "瓦片超出范围"}, status=404)
+        registry.inc("tools_zero_bytes_sent_total", len(data), node="ImageCropper")
+        
+        return web.Response(body=data, content_type="image/png",
+                            headers={"Cache-Control": "no-store"})
+        
+    except Exception as e:
+        print(f"[ImageCropper] 瓦片请求处理出错: {str(e)}")
+        traceback.print_exc()
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
 @PromptServer.instance.routes.post("/zero_image_cropper/cancel")
 async def cancel_crop(request):
     try:
@@ -263,6 +278,7 @@ async def cancel_crop(request):
         if node_id in crop_node_data:
             # 设置事件，让节点继续执行
             crop_node_data[node_id]["event"].set()
+            registry.inc("tools_zero_cancels_total", node="ImageCropper")
             print(f"[ImageCropper] 取消裁剪操作: 节点ID {node_id}")
             return web.json_response({"success": True})
         
@@ -0,0 +1,27 @@
+from server import PromptServer
+from aiohttp import web
+import traceback
+from .tools_zero_core.metrics import registry, traces
+from .execution import current_prompt_id
+
+@PromptServer.instance.routes.get("/zero_tools/metrics")
+async def get_metrics(request):
+    try:
+        return web.Response(text=registry.render(), content_type="text/plain",
+                            headers={"X-Content-Type-Options": "nosniff"})
+    except Exception as e:
+        print(f"[Metrics] 指标导出出错: {str(e)}")
+        traceback.print_exc()
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+@PromptServer.instance.routes.get("/zero_tools/trace")
+async def get_trace(request):
+    try:
+        prompt_id = request.query.get("prompt_id") or current_prompt_id()
+        if prompt_id is None:
+            return web.json_response({"success": False, "error": "缺少prompt_id"}, status=404)
+        return web.json_response(traces.chrome_trace(prompt_id))
+    except Exception as e:
+        print(f"[Metrics] trace导出出错: {str(e)}")
+        traceback.print_exc()
+        return web.json_response({"success": False, "error": str(e)}, status=500)
@@ -0,0 +1,9 @@
+"""
+tools_zero 的计算核心：文本排版与光栅化、颜色统计、裁剪与瓦片金字塔
+
+不依赖ComfyUI和aiohttp，torch/numpy只在用到时导入。节点和路由（py/*.py）只是这层之上的适配。
+在ComfyUI之外使用时把仓库的 py 目录加入 sys.path：
+
+    sys.path.insert(0, "<仓库>/py")
+    from tools_zero_core import text_layout, keyframes
+"""
@@ -0,0 +1,289 @@
+"""颜色统计、遮罩区域和预览编码，torch/numpy/PIL在函数内按需导入"""
+import io
+
+# 统计的分位数（百分比）
+STAT_PERCENTILES = (0.5, 1, 5, 25, 50, 75, 95, 99, 99.5)
+# 滑块取值范围
+SLIDER_MIN = 0.0
+SLIDER_MAX = 2.0
+# 可用关键帧控制的颜色参数，1.0 表示不调整，含义与前端滑块一致
+COLOR_PARAMS = ("brightness", "contrast", "saturation", "hue", "temperature", "tint", "gamma", "vibrance")
+# adjust_colors 每次处理的帧数，限制中间张量的内存占用
+COLOR_CHUNK_FRAMES = 16
+
+def compute_statistics(image):
+    """
+    在整批图像上计算逐通道统计信息（0-255刻度）
+
+    返回直方图、分位数、均值和灰度世界增益，逐帧用torch向量化计算，
+    不会为整批图像分配额外的整型副本
+    """
+    import torch
+
+    names = ("r", "g", "b", "luminance")
+    weights = torch.tensor([0.299, 0.587, 0.114], dtype=image.dtype, device=image.device)
+    histograms = torch.zeros((4, 256), dtype=torch.float64)
+    sums = torch.zeros(4, dtype=torch.float64)
+
+    for frame in image:
+        rgb = torch.clamp(frame[..., :3], 0, 1)
+        luminance = rgb @ weights
+        channels = [rgb[..., 0], rgb[..., 1], rgb[..., 2], luminance]
+        for c, channel in enumerate(channels):
+            histograms[c] += torch.histc(channel.float(), bins=256, min=0, max=1).double().cpu()
+            sums[c] += channel.sum(dtype=torch.float64).cpu()
+
+    total = max(1, int(histograms[0].sum().item()))
+    cdf = histograms.cumsum(dim=1)
+    targets = torch.tensor(STAT_PERCENTILES, dtype=torch.float64) / 100 * total
+    percentile_bins = torch.searchsorted(cdf, targets.expand(4, -1).contiguous())
+    percentile_bins = torch.clamp(percentile_bins, 0, 255)
+    means = sums / total * 255
+
+    gray = means[:3].mean().item()
+    statistics = {
+        "pixels": total,
+        "histogram": {name: histograms[c].long().tolist() for c, name in enumerate(names)},
+        "percentiles": {
+            name: {str(p): int(percentile_bins[c, i]) for i, p in enumerate(STAT_PERCENTILES)}
+            for c, name in enumerate(names)
+        },
+        "mean": {name: means[c].item() for c, name in enumerate(names)},
+        "gray_world": {
+            "gray": gray,
+            **{f"{name}_gain": (gray / means[c].item() if means[c].item() > 0 else 1.0)
+               for c, name in enumerate(names[:3])}
+        },
+    }
+    statistics["suggestions"] = suggest_adjustments(statistics)
+    return statistics
+
+def encode_preview(frame):
+    """将单帧图像 [H, W, C] 编码为PNG字节，前端以二进制方式获取"""
+    import numpy as np
+    import torch
+    from PIL import Image
+
+    preview_image = (torch.clamp(frame, 0, 1) * 255).cpu().numpy().astype(np.uint8)
+    pil_image = Image.fromarray(preview_image)
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+def prepare_mask(mask, height, width, feather=0, batch=None):
+    """
+    将遮罩调整到图像尺寸并计算需要处理的区域
+
+    返回 (box, alpha)：box 为 (x0, y0, x1, y1)，已按羽化半径向外扩展并裁剪到图像内；
+    alpha 为区域内羽化后的遮罩 [B, h, w]。遮罩为空时返回 (None, None)。
+    给出图像批次大小batch时，遮罩批次必须为1或batch，否则抛出ValueError
+    """
+    import torch
+
+    if mask.dim() == 2:
+        mask = mask.unsqueeze(0)
+    if batch is not None and mask.shape[0] not in (1, batch):
+        raise ValueError(f"遮罩批次大小 {mask.shape[0]} 与图像批次大小 {batch} 不匹配，应为1或{batch}")
+    mask = mask.float()
+    if mask.shape[1] != height or mask.shape[2] != width:
+        mask = torch.nn.functional.interpolate(mask.unsqueeze(1), size=(height, width),
+                                               mode="bilinear", align_corners=False).squeeze(1)
+
+    # 所有帧遮罩的并集决定处理区域
+    coverage = (mask > 0).any(dim=0)
+    rows = torch.nonzero(coverage.any(dim=1)).flatten()
+    cols = torch.nonzero(coverage.any(dim=0)).flatten()
+    if rows.numel() == 0:
+        return None, None
+
+    x0 = max(0, int(cols[0]) - feather)
+    y0 = max(0, int(rows[0]) - feather)
+    x1 = min(width, int(cols[-1]) + 1 + feather)
+    y1 = min(height, int(rows[-1]) + 1 + feather)
+
+    alpha = mask[:, y0:y1, x0:x1]
+    if feather > 0:
+        # 可分离高斯模糊，只在区域内计算
+        sigma = feather / 2
+        offsets = torch.arange(-feather, feather + 1, dtype=torch.float32, device=alpha.device)
+        kernel = torch.exp(-offsets ** 2 / (2 * sigma ** 2))
+        kernel = kernel / kernel.sum()
+        alpha = alpha.unsqueeze(1)
+        alpha = torch.nn.functional.pad(alpha, (feather, feather, 0, 0), mode="replicate")
+        alpha = torch.nn.functional.conv2d(alpha, kernel.view(1, 1, 1, -1))
+        alpha = torch.nn.functional.pad(alpha, (0, 0, feather, feather), mode="replicate")
+        alpha = torch.nn.functional.conv2d(alpha, kernel.view(1, 1, -1, 1))
+        alpha = alpha.squeeze(1)
+    return (x0, y0, x1, y1), torch.clamp(alpha, 0, 1)
+
+def suggest_adjustments(statistics, low_percentile=0.5, high_percentile=99.5):
+    """
+    根据统计信息推导前端滑块的建议值
+
+    自动对比度：把亮度的低/高分位数拉伸到0-255，对应前端的
+    v' = v * brightness * contrast + 128 * (1 - contrast)
+    自动白平衡：按灰度世界假设让色温/色调调整后三通道均值相等，对应前端的
+    r += 30T - 15K, g += 30K, b -= 30T + 15K（T = temperature - 1, K = tint - 1）
+    """
+    def clamp(value):
+        return float(min(SLIDER_MAX, max(SLIDER_MIN, value)))
+
+    suggestions = {}
+
+    low = statistics["percentiles"]["luminance"][str(low_percentile)]
+    high = statistics["percentiles"]["luminance"][str(high_percentile)]
+    if high > low:
+        contrast = 1 + 255 * low / (128 * (high - low))
+        brightness = 255 / ((high - low) * contrast)
+        suggestions["contrast"] = clamp(contrast)
+        suggestions["brightness"] = clamp(brightness)
+    else:
+        suggestions["contrast"] = 1.0
+        suggestions["brightness"] = 1.0
+
+    mean = statistics["mean"]
+    temperature_shift = (mean["b"] - mean["r"]) / 2
+    tint_shift = ((mean["r"] + mean["b"]) / 2 - mean["g"]) / 1.5
+    suggestions["temperature"] = clamp(1 + temperature_shift / 30)
+    suggestions["tint"] = clamp(1 + tint_shift / 30)
+    return suggestions
+
+def decode_rgba(adjusted_data, shape):
+    """
+    将前端提交的RGBA数据解码为图像张量
+
+    adjusted_data 为原始RGBA字节或整数列表，shape 为 (batch, height, width, channels)，
+    数据不足时返回None
+    """
+    import numpy as np
+    import torch
+
+    batch, height, width, channels = shape
+    if len(adjusted_data) < height * width * 4:
+        return None
+    if isinstance(adjusted_data, (bytes, bytearray, memoryview)):
+        rgba_array = np.frombuffer(adjusted_data, dtype=np.uint8, count=height * width * 4)
+    else:
+        rgba_array = np.array(adjusted_data, dtype=np.uint8)[:height * width * 4]
+    rgb_array = rgba_array.reshape(height, width, 4)[:, :, :3]
+    return torch.from_numpy(rgb_array / 255.0).float().reshape(batch, height, width, channels)
+
+def blend_region(image, box, alpha, adjusted):
+    """按遮罩把调整后的区域混合回原图的副本，区域外保持原图"""
+    output = image.clone()
+    x0, y0, x1, y1 = box
+    alpha = alpha.to(device=output.device, dtype=output.dtype).unsqueeze(-1)
+    adjusted = adjusted.to(device=output.device, dtype=output.dtype)
+    pixels = output[:, y0:y1, x0:x1, :3]
+    pixels.mul_(1 - alpha).add_(adjusted[..., :3] * alpha)
+    return output
+
+def _rgb_to_hsl(r, g, b):
+    """0-1 范围的RGB转HSL，与前端 rgbToHsl 相同"""
+    import torch
+
+    mx = torch.maximum(torch.maximum(r, g), b)
+    mn = torch.minimum(torch.minimum(r, g), b)
+    l = (mx + mn) / 2
+    d = mx - mn
+    gray = d == 0
+    safe_d = torch.where(gray, torch.ones_like(d), d)
+    s = torch.where(l > 0.5, d / (2 - mx - mn).clamp_min(1e-12), d / (mx + mn).clamp_min(1e-12))
+    h = torch.where(mx == r, (g - b) / safe_d + torch.where(g < b, 6.0, 0.0),
+                    torch.where(mx == g, (b - r) / safe_d + 2, (r - g) / safe_d + 4)) / 6
+    return torch.where(gray, 0.0, h), torch.where(gray, 0.0, s), l
+
+def _hsl_to_rgb(h, s, l):
+    """HSL转0-1 范围的RGB，与前端 hslToRgb 等价"""
+    import torch
+
+    a = s * torch.minimum(l, 1 - l)
+    def channel(n):
+        k = torch.remainder(n + h * 12, 12)
+        return l - a * torch.clamp(torch.minimum(k - 3, 9 - k), -1, 1)
+    return channel(0), channel(8), channel(4)
+
+def _adjust_chunk(rgb, params):
+    """对 [B, H, W, 3]（0-255刻度）应用逐帧参数，params 为 {参数: [B, 1, 1] 张量}"""
+    import torch
+
+    r, g, b = rgb.unbind(-1)
+
+    # 色温：增加红色、减少蓝色（或相反）
+    temperature = (params["temperature"] - 1) * 30
+    r = torch.clamp(r + temperature, 0, 255)
+    b = torch.clamp(b - temperature, 0, 255)
+
+    # 色调：绿色与洋红
+    tint = (params["tint"] - 1) * 30
+    g = torch.clamp(g + tint, 0, 255)
+    r = torch.clamp(r - tint * 0.5, 0, 255)
+    b = torch.clamp(b - tint * 0.5, 0, 255)
+
+    # 色相：0-2 映射到 -180 到 +180 度，只处理需要调整的帧
+    hue_active = params["hue"] != 1
+    if hue_active.any():
+        h, s, l = _rgb_to_hsl(r / 255, g / 255, b / 255)
+        h = torch.remainder(h + (params["hue"] - 1) / 2, 1)
+        nr, ng, nb = _hsl_to_rgb(h, s, l)
+        r = torch.where(hue_active, nr * 255, r)
+        g = torch.where(hue_active, ng * 255, g)
+        b = torch.where(hue_active, nb * 255, b)
+
+    # 亮度与对比度
+    brightness = params["brightness"]
+    contrast = params["contrast"]
+    offset = 128 * (1 - contrast)
+    r = torch.clamp(r * brightness, max=255) * contrast + offset
+    g = torch.clamp(g * brightness, max=255) * contrast + offset
+    b = torch.clamp(b * brightness, max=255) * contrast + offset
+
+    # 伽马校正
+    gamma_active = params["gamma"] != 1
+    if gamma_active.any():
+        inv_gamma = 1 / params["gamma"]
+        r = torch.where(gamma_active, torch.pow(r.clamp_min(0) / 255, inv_gamma) * 255, r)
+        g = torch.where(gamma_active, torch.pow(g.clamp_min(0) / 255, inv_gamma) * 255, g)
+        b = torch.where(gamma_active, torch.pow(b.clamp_min(0) / 255, inv_gamma) * 255, b)
+
+    # 饱和度
+    saturation = params["saturation"]
+    luma = r * 0.299 + g * 0.587 + b * 0.114
+    r = luma + (r - luma) * saturation
+    g = luma + (g - luma) * saturation
+    b = luma + (b - luma) * saturation
+
+    # 自然饱和度：已饱和的颜色和接近中性的颜色调整得更少
+    vibrance = params["vibrance"]
+    mx = torch.maximum(torch.maximum(r, g), b)
+    amount = (mx - (r + g + b) / 3) * 2 / 255
+    neutral = ((r - g).abs() < 20) & ((r - b).abs() < 20) & ((g - b).abs() < 20)
+    factor = 1 + (1 - amount) * (vibrance - 1) * torch.where(neutral, 0.5, 1.0)
+    luma = r * 0.299 + g * 0.587 + b * 0.114
+    r = luma + (r - luma) * factor
+    g = luma + (g - luma) * factor
+    b = luma + (b - luma) * factor
+
+    return torch.stack((r, g, b), dim=-1).clamp_(0, 255)
+
+def adjust_colors(image, frames, chunk_frames=COLOR_CHUNK_FRAMES):
+    """
+    按逐帧参数调整整批图像的颜色，算法与前端 adjustColors 一致（伽马前同样把负值截断到0），
+    结果不量化到8位
+
+    frames 为每帧一个 {参数: 值} 字典（见 COLOR_PARAMS），参数转为 [B] 张量后广播到像素上，
+    每次处理 chunk_frames 帧以限制内存；返回新的图像张量，alpha等额外通道保持不变
+    """
+    import torch
+
+    output = image.clone()
+    values = {
+        name: torch.tensor([frame.get(name, 1.0) for frame in frames], dtype=torch.float32, device=image.device)
+        for name in COLOR_PARAMS
+    }
+    for start in range(0, image.shape[0], chunk_frames):
+        end = min(start + chunk_frames, image.shape[0])
+        params = {name: value[start:end].view(-1, 1, 1) for name, value in values.items()}
+        rgb = image[start:end, ..., :3].to(torch.float32) * 255
+        output[start:end, ..., :3] = (_adjust_chunk(rgb, params) / 255).to(output.dtype)
+    return output
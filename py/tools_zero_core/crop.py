@@ -0,0 +1,166 @@
+"""裁剪与预览瓦片金字塔，torch/PIL在用到时才导入"""
+import io
+import math
+import threading
+from collections import OrderedDict
+
+# 瓦片边长（像素）
+TILE_SIZE = 256
+# 瓦片LRU缓存上限（个）
+TILE_CACHE_SIZE = 512
+
+class TilePyramid:
+    """
+    图像的多分辨率瓦片金字塔
+
+    第0层为原图，第k层为原图缩小2^k倍，各层在首次请求时由上一层2x2平均池化得到。
+    最顶层整张图不超过一个瓦片。
+    """
+
+    def __init__(self, image, tile_size=TILE_SIZE):
+        # image: [H, W, C]
+        self.tile_size = tile_size
+        self.height = image.shape[0]
+        self.width = image.shape[1]
+        self.levels = max(1, math.ceil(math.log2(max(self.width, self.height) / tile_size)) + 1)
+        self._levels = {0: image[..., :3]}
+        self._lock = threading.Lock()
+
+    def level(self, level):
+        with self._lock:
+            return self._build_level(level)
+
+    def _build_level(self, level):
+        if level not in self._levels:
+            import torch
+
+            previous = self._build_level(level - 1)
+            pooled = torch.nn.functional.avg_pool2d(previous.permute(2, 0, 1).unsqueeze(0),
+                                                    kernel_size=2, ceil_mode=True)
+            self._levels[level] = pooled.squeeze(0).permute(1, 2, 0)
+        return self._levels[level]
+
+    def tile_png(self, level, x, y):
+        """编码指定层级的瓦片为PNG，坐标超出范围时返回None"""
+        if level < 0 or level >= self.levels:
+            return None
+        pixels = self.level(level)
+        top, left = y * self.tile_size, x * self.tile_size
+        if x < 0 or y < 0 or top >= pixels.shape[0] or left >= pixels.shape[1]:
+            return None
+        import torch
+        from PIL import Image
+
+        tile = pixels[top:top + self.tile_size, left:left + self.tile_size]
+        tile = (torch.clamp(tile, 0, 1) * 255).round().to(torch.uint8).cpu().numpy()
+        buffer = io.BytesIO()
+        Image.fromarray(tile).save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+class TileCache:
+    """
+    按 (session, level, x, y) 缓存瓦片PNG的LRU缓存，线程安全
+
+    session 为每次节点执行生成的令牌，open() 之后才会缓存该会话的瓦片；
+    release() 之后仍在编码的瓦片不会再写入缓存，避免下次执行读到旧图像的瓦片
+    """
+
+    def __init__(self, max_size=TILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._tiles = OrderedDict()
+        self._sessions = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def open(self, session):
+        """开始缓存会话的瓦片"""
+        with self._lock:
+            self._sessions.add(session)
+
+    def get(self, session, pyramid, level, x, y):
+        """返回缓存的瓦片，未命中时由pyramid编码，会话仍未释放时放入缓存"""
+        key = (session, level, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        data = pyramid.tile_png(level, x, y)
+        if data is not None:
+            with self._lock:
+                if session in self._sessions:
+                    self._tiles[key] = data
+                    while len(self._tiles) > self.max_size:
+                        self._tiles.popitem(last=False)
+        return data
+
+    def release(self, session):
+        """结束会话并清除其全部瓦片"""
+        with self._lock:
+            self._sessions.discard(session)
+            for key in [key for key in self._tiles if key[0] == session]:
+                del self._tiles[key]
+
+def clamp_crop_box(x, y, width, height, image_width, image_height):
+    """把裁剪区域限制在图像范围内，返回 (x, y, width, height)，宽高可能不为正"""
+    valid_x = min(max(0, int(x)), image_width - 1)
+    valid_y = min(max(0, int(y)), image_height - 1)
+    valid_width = min(int(width), image_width - valid_x)
+    valid_height = min(int(height), image_height - valid_y)
+    return valid_x, valid_y, valid_width, valid_height
+
+def _crop_mask(mask, height, width, box):
+    """按已限制在图像内的裁剪框裁剪遮罩，遮罩缺失或尺寸与原图不一致时返回None"""
+    if mask is None:
+        return None
+    if mask.shape[1] != height or mask.shape[2] != width:
+        print(f"[ImageCropper] 警告: 遮罩尺寸与原始图像不匹配: 遮罩={tuple(mask.shape)}, 图像尺寸={(height, width)}")
+        return None
+    x, y, crop_width, crop_height = box
+    return mask[:, y:y + crop_height, x:x + crop_width]
+
+def crop_tensors(image, mask, box):
+    """
+    按裁剪框 (x, y, width, height) 直接在原图张量上裁剪图像和遮罩
+
+    返回 (image, mask)；裁剪框无效时两者都为None，遮罩缺失或尺寸与原图不一致时遮罩为None
+    """
+    height, width = image.shape[1], image.shape[2]
+    x, y, crop_width, crop_height = clamp_crop_box(*box, width, height)
+    if crop_width <= 0 or crop_height <= 0:
+        print(f"[ImageCropper] 警告: 裁剪区域无效: x={x}, y={y}, width={crop_width}, height={crop_height}")
+        return None, None
+    box = (x, y, crop_width, crop_height)
+    return image[:, y:y + crop_height, x:x + crop_width, :], _crop_mask(mask, height, width, box)
+
+def decode_crop_upload(data, original_image, original_mask, box):
+    """
+    解码前端上传的裁剪结果PNG，返回 (image, mask)
+
+    遮罩由原始遮罩按裁剪框裁剪得到，尺寸与上传图像不一致时按最近邻缩放；
+    没有原始图像或遮罩、裁剪框无效时遮罩为None
+    """
+    import numpy as np
+    import torch
+    from PIL import Image
+
+    pil_image = Image.open(io.BytesIO(data))
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    image = torch.from_numpy(np.array(pil_image) / 255.0).float().unsqueeze(0)
+
+    if original_image is None or original_mask is None:
+        return image, None
+    height, width = original_image.shape[1], original_image.shape[2]
+    x, y, crop_width, crop_height = clamp_crop_box(*box, width, height)
+    if crop_width <= 0 or crop_height <= 0:
+        print(f"[ImageCropper] 警告: 裁剪区域无效: x={x}, y={y}, width={crop_width}, height={crop_height}")
+        return image, None
+
+    mask = _crop_mask(original_mask, height, width, (x, y, crop_width, crop_height))
+    if mask is not None and (mask.shape[1] != image.shape[1] or mask.shape[2] != image.shape[2]):
+        print(f"[ImageCropper] 调整遮罩尺寸以匹配图像: 遮罩={tuple(mask.shape)}, 图像={tuple(image.shape)}")
+        mask = torch.nn.functional.interpolate(mask.unsqueeze(1), size=(image.shape[1], image.shape[2]),
+                                               mode="nearest").squeeze(1)
+    return image, mask
@@ -0,0 +1,211 @@
+import os
+import json
+import struct
+import threading
+
+# 索引文件保存在字体目录下，按文件大小和修改时间判断是否需要重建
+INDEX_FILE_NAME = ".glyph_index.json"
+INDEX_VERSION = 1
+FONT_EXTENSIONS = ('.ttf', '.otf')
+
+def _merge_ranges(codepoints):
+    """将码位集合压缩为闭区间列表 [[start, end], ...]"""
+    ranges = []
+    for cp in sorted(codepoints):
+        if ranges and cp == ranges[-1][1] + 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return ranges
+
+def _read_format4(data, offset):
+    seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+    end_codes = struct.unpack_from(f'>{seg_count}H', data, offset + 14)
+    start_offset = offset + 16 + seg_count * 2
+    start_codes = struct.unpack_from(f'>{seg_count}H', data, start_offset)
+    id_deltas = struct.unpack_from(f'>{seg_count}h', data, start_offset + seg_count * 2)
+    range_offset_pos = start_offset + seg_count * 4
+    id_range_offsets = struct.unpack_from(f'>{seg_count}H', data, range_offset_pos)
+
+    codepoints = set()
+    for i in range(seg_count):
+        start, end = start_codes[i], end_codes[i]
+        if start == 0xFFFF:
+            continue
+        for cp in range(start, end + 1):
+            if id_range_offsets[i] == 0:
+                glyph_id = (cp + id_deltas[i]) & 0xFFFF
+            else:
+                pos = range_offset_pos + i * 2 + id_range_offsets[i] + (cp - start) * 2
+                if pos + 2 > len(data):
+                    continue
+                glyph_id = struct.unpack_from('>H', data, pos)[0]
+                if glyph_id:
+                    glyph_id = (glyph_id + id_deltas[i]) & 0xFFFF
+            if glyph_id:
+                codepoints.add(cp)
+    return codepoints
+
+def _read_format12(data, offset):
+    num_groups = struct.unpack_from('>I', data, offset + 12)[0]
+    codepoints = set()
+    for i in range(num_groups):
+        start, end, start_glyph = struct.unpack_from('>III', data, offset + 16 + i * 12)
+        if start_glyph == 0:
+            start += 1
+        codepoints.update(range(start, end + 1))
+    return codepoints
+
+def read_cmap_coverage(font_path):
+    """
+    读取字体cmap表覆盖的Unicode码位
+
+    只解析 format 4 (BMP) 和 format 12 (全平面) 子表，无法解析时返回空集合
+    """
+    with open(font_path, 'rb') as f:
+        data = f.read()
+
+    sfnt_offset = 0
+    if data[:4] == b'ttcf':
+        # 字体集合只索引第一个字体
+        sfnt_offset = struct.unpack_from('>I', data, 12)[0]
+
+    num_tables = struct.unpack_from('>H', data, sfnt_offset + 4)[0]
+    cmap_offset = None
+    for i in range(num_tables):
+        tag, _, table_offset, _ = struct.unpack_from('>4sIII', data, sfnt_offset + 12 + i * 16)
+        if tag == b'cmap':
+            cmap_offset = table_offset
+            break
+    if cmap_offset is None:
+        return set()
+
+    num_subtables = struct.unpack_from('>H', data, cmap_offset + 2)[0]
+    best = None
+    for i in range(num_subtables):
+        platform_id, encoding_id, sub_offset = struct.unpack_from('>HHI', data, cmap_offset + 4 + i * 8)
+        sub_format = struct.unpack_from('>H', data, cmap_offset + sub_offset)[0]
+        # Unicode子表优先选择全平面的format 12
+        if platform_id == 0 or (platform_id == 3 and encoding_id in (1, 10)):
+            if sub_format == 12:
+                priority = 0
+            elif sub_format == 4:
+                priority = 1
+            else:
+                continue
+            if best is None or priority < best[0]:
+                best = (priority, sub_format, cmap_offset + sub_offset)
+    if best is None:
+        return set()
+
+    _, sub_format, offset = best
+    if sub_format == 12:
+        return _read_format12(data, offset)
+    return _read_format4(data, offset)
+
+class GlyphIndex:
+    """
+    字体目录的字形覆盖索引
+
+    coverage: {字体文件名: 码位集合}
+    first_font: {码位: 按文件名排序后第一个包含该字形的字体}
+    """
+
+    def __init__(self, font_dir):
+        self.font_dir = font_dir
+        self.index_path = os.path.join(font_dir, INDEX_FILE_NAME)
+        self.entries = {}
+        self.coverage = {}
+        self.first_font = {}
+        self.signature = None
+
+    def _font_signatures(self):
+        signatures = {}
+        if not os.path.isdir(self.font_dir):
+            return signatures
+        for file in sorted(os.listdir(self.font_dir)):
+            if file.lower().endswith(FONT_EXTENSIONS):
+                stat = os.stat(os.path.join(self.font_dir, file))
+                signatures[file] = (stat.st_size, int(stat.st_mtime))
+        return signatures
+
+    def _load_entries(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                return data.get("fonts", {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def refresh(self):
+        """字体目录有变化时增量重建索引并写回磁盘，没有变化时直接返回"""
+        signatures = self._font_signatures()
+        if signatures == self.signature:
+            return self
+
+        if self.signature is None:
+            self.entries = self._load_entries()
+
+        changed = False
+        entries = {}
+        for file, (size, mtime) in signatures.items():
+            entry = self.entries.get(file)
+            if entry is None or entry.get("size") != size or entry.get("mtime") != mtime:
+                try:
+                    ranges = _merge_ranges(read_cmap_coverage(os.path.join(self.font_dir, file)))
+                except (OSError, struct.error) as e:
+                    print(f"[TextImage] 警告：无法读取字体 {file} 的cmap表: {str(e)}")
+                    ranges = []
+                entry = {"size": size, "mtime": mtime, "ranges": ranges}
+                changed = True
+            entries[file] = entry
+        if set(entries) != set(self.entries):
+            changed = True
+        self.entries = entries
+
+        if changed:
+            try:
+                with open(self.index_path, 'w', encoding='utf-8') as f:
+                    json.dump({"version": INDEX_VERSION, "fonts": self.entries}, f)
+            except OSError as e:
+                print(f"[TextImage] 警告：无法写入字形索引 {self.index_path}: {str(e)}")
+
+        self.coverage = {}
+        self.first_font = {}
+        for file, entry in self.entries.items():
+            codepoints = set()
+            for start, end in entry["ranges"]:
+                codepoints.update(range(start, end + 1))
+            self.coverage[file] = codepoints
+            for cp in codepoints:
+                self.first_font.setdefault(cp, file)
+        self.signature = signatures
+        return self
+
+    def covers(self, font_file, text):
+        """字体是否包含text中的全部字符；未被索引的字体视为全部包含"""
+        codepoints = self.coverage.get(font_file)
+        if codepoints is None:
+            return True
+        return all(ord(char) in codepoints for char in text)
+
+    def resolve(self, font_file, char):
+        """返回用于绘制char的字体文件名：主字体包含时用主字体，否则用回退链中第一个包含的字体"""
+        codepoints = self.coverage.get(font_file)
+        cp = ord(char)
+        if codepoints is None or cp in codepoints:
+            return font_file
+        return self.first_font.get(cp, font_file)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_glyph_index(font_dir):
+    """获取字体目录的字形索引，每个目录只构建一次，字体文件变化时增量更新"""
+    with _indexes_lock:
+        index = _indexes.get(font_dir)
+        if index is None:
+            index = _indexes[font_dir] = GlyphIndex(font_dir)
+        return index.refresh()
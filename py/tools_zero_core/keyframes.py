@@ -0,0 +1,55 @@
+def parse_keyframes(keyframes, names):
+    """
+    解析关键帧文本
+
+    每行格式为 "帧号: 参数=值, 参数=值"，names 为允许出现的参数名，
+    返回 {参数: [(帧号, 值), ...]}
+    """
+    tracks = {}
+    for line_no, line in enumerate((keyframes or "").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if ":" not in line:
+            raise ValueError(f"关键帧第{line_no}行格式错误: {line}")
+        frame, values = line.split(":", 1)
+        frame = int(frame.strip())
+        for item in values.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "=" not in item:
+                raise ValueError(f"关键帧第{line_no}行格式错误: {item}")
+            name, value = (part.strip() for part in item.split("=", 1))
+            if name not in names:
+                raise ValueError(f"关键帧第{line_no}行包含未知参数: {name}")
+            tracks.setdefault(name, []).append((frame, float(value)))
+    for points in tracks.values():
+        points.sort(key=lambda point: point[0])
+    return tracks
+
+def interpolate_keyframes(tracks, base_values, frame_count):
+    """
+    将关键帧线性插值为逐帧参数
+
+    没有关键帧的参数保持base_values中的值；第0帧未指定时以base_values为起点，
+    最后一个关键帧之后保持不变。整数参数插值后四舍五入。
+    """
+    frames = []
+    for index in range(frame_count):
+        params = {}
+        for name, base in base_values.items():
+            points = tracks.get(name)
+            if not points:
+                params[name] = base
+                continue
+            if points[0][0] > 0:
+                points = [(0, float(base))] + points
+            value = points[-1][1]
+            for (f0, v0), (f1, v1) in zip(points, points[1:]):
+                if f0 <= index <= f1:
+                    value = v0 if f1 == f0 else v0 + (v1 - v0) * (index - f0) / (f1 - f0)
+                    break
+            params[name] = int(round(value)) if isinstance(base, int) else value
+        frames.append(params)
+    return frames
@@ -0,0 +1,195 @@
+"""
+耗时统计与Chrome trace记录，纯Python实现
+
+span() 计时一个阶段，结果同时进入直方图 tools_zero_phase_seconds 和当前prompt的trace；
+registry.render() 输出Prometheus文本格式，traces.chrome_trace() 输出可在 chrome://tracing 打开的JSON。
+"""
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 阶段耗时直方图的桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 设置该环境变量后，每个prompt的trace会写入该目录下的 <prompt_id>.json
+TRACE_DIR_ENV = "TOOLS_ZERO_TRACE_DIR"
+# 内存中保留trace的prompt数量
+TRACE_MAX_PROMPTS = 16
+
+_current_prompt = contextvars.ContextVar("tools_zero_prompt_id", default=None)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    escaped = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class MetricsRegistry:
+    """计数器、直方图和按需求值的仪表，线程安全"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def gauge(self, name, fn, **labels):
+        """注册一个在导出时调用fn()求值的仪表"""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = fn
+
+    def render(self):
+        """导出Prometheus文本格式"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: ([*h[0]], h[1], h[2]) for key, h in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        lines = []
+        written = set()
+        def header(name, kind):
+            if (name, kind) in written:
+                return
+            written.add((name, kind))
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), fn in sorted(gauges.items(), key=lambda item: item[0]):
+            header(name, "gauge")
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (bucket_counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+class TraceRecorder:
+    """按prompt保存Chrome trace事件，只保留最近的若干个prompt"""
+
+    def __init__(self, max_prompts=TRACE_MAX_PROMPTS):
+        self.max_prompts = max_prompts
+        self._lock = threading.Lock()
+        self._prompts = OrderedDict()
+
+    def record(self, prompt_id, name, category, start, duration, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            events = self._prompts.get(prompt_id)
+            if events is None:
+                events = self._prompts[prompt_id] = []
+                while len(self._prompts) > self.max_prompts:
+                    self._prompts.popitem(last=False)
+            events.append(event)
+
+    def chrome_trace(self, prompt_id):
+        with self._lock:
+            events = list(self._prompts.get(prompt_id, ()))
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"prompt_id": prompt_id}}
+
+    def dump(self, prompt_id, directory=None):
+        """
+        把prompt的trace写入目录，未指定目录且未设置环境变量时不写
+
+        文件名只保留prompt_id中的字母、数字、下划线和短横线，写入失败时只打印日志，返回None
+        """
+        directory = directory or os.environ.get(TRACE_DIR_ENV)
+        if not directory or prompt_id is None:
+            return None
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", str(prompt_id))
+        path = os.path.join(directory, f"{name}.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.chrome_trace(prompt_id), f)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Metrics] trace写入失败: {path}: {str(e)}")
+            return None
+        return path
+
+registry = MetricsRegistry()
+traces = TraceRecorder()
+
+registry.describe("tools_zero_phase_seconds", "各节点各阶段耗时（秒）")
+registry.describe("tools_zero_timeouts_total", "等待前端超时次数")
+registry.describe("tools_zero_cancels_total", "前端取消次数")
+registry.describe("tools_zero_bytes_sent_total", "推送给前端的字节数")
+registry.describe("tools_zero_bytes_received_total", "从前端接收的字节数")
+registry.describe("tools_zero_live_sessions", "正在等待前端应答的会话数")
+
+@contextmanager
+def prompt_context(prompt_id):
+    """在上下文内把span归到prompt_id的trace下"""
+    token = _current_prompt.set(prompt_id)
+    try:
+        yield
+    finally:
+        _current_prompt.reset(token)
+
+@contextmanager
+def span(node, phase, prompt_id=None, **args):
+    """计时一个阶段，写入直方图和当前prompt的trace（路由中没有prompt上下文，需显式传入prompt_id）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe("tools_zero_phase_seconds", duration, node=node, phase=phase)
+        if prompt_id is None:
+            prompt_id = _current_prompt.get()
+        # 不在任何prompt内的阶段只计入直方图
+        if prompt_id is not None:
+            traces.record(prompt_id, f"{node}.{phase}", node, start, duration, args)
@@ -0,0 +1,511 @@
+"""文本排版与光栅化，只依赖PIL；torch/numpy在生成张量时才导入"""
+import os
+import random
+from functools import lru_cache
+
+from PIL import Image, ImageFont, ImageDraw, ImageColor
+
+from .metrics import span
+
+# 关键帧中允许动画的参数
+ANIMATABLE_PARAMS = ("x_offset", "y_offset", "scale", "variation_seed")
+
+@lru_cache(maxsize=256)
+def _truetype(font_path, size):
+    return ImageFont.truetype(font_path, size)
+
+def load_font(font_path, size, fallback=None):
+    """按(路径, 字号)缓存加载字体，失败时返回fallback或PIL默认字体"""
+    try:
+        return _truetype(font_path, size)
+    except Exception:
+        return fallback if fallback is not None else ImageFont.load_default()
+
+@lru_cache(maxsize=4096)
+def get_glyph(font, char):
+    """
+    缓存单个字符的字形位图
+
+    返回 (L模式位图, (left, top))，left/top 为相对绘制坐标的偏移；空白字符返回 (None, (0, 0))
+    """
+    left, top, right, bottom = font.getbbox(char)
+    if right <= left or bottom <= top:
+        return None, (0, 0)
+    glyph = Image.new('L', (right - left, bottom - top), color=0)
+    ImageDraw.Draw(glyph).text((-left, -top), char, font=font, fill=255)
+    return glyph, (left, top)
+
+def random_numbers(total, random_range=10, seed=None, sum_of_numbers=0):
+    if seed is not None:
+        random.seed(seed)
+
+    numbers = [random.randint(-random_range, random_range) for _ in range(total)]
+
+    # 如果需要让这些数字加起来为指定值
+    if sum_of_numbers is not None:
+        current_sum = sum(numbers)
+        diff = sum_of_numbers - current_sum
+        adjustment = diff // total
+
+        for i in range(total):
+            numbers[i] += adjustment
+
+        # 处理余数
+        remainder = diff - adjustment * total
+        for i in range(remainder):
+            numbers[i] += 1
+
+    return numbers
+
+def layout_text(text, font_path, spacing, leading, scale, variation_range, variation_seed,
+                layout, width, height, h_align, v_align, glyph_index=None):
+    """
+    计算每个字符的字体和位置（不含x/y偏移）
+
+    传入glyph_index时，主字体缺少的字符按索引切换到回退字体。
+    返回按行组织的字符表，每项为 {'char', 'axis', 'font', 'size'}
+    """
+    font_dir, font_file = os.path.split(font_path)
+
+    # 处理文本行
+    text_table = []
+    max_char_in_line = 0
+    total_char = 0
+    lines = []
+    text_lines = text.split("\n")
+    for l in text_lines:
+        if len(l) > 0:
+            lines.append(l)
+            total_char += len(l)
+            if len(l) > max_char_in_line:
+                max_char_in_line = len(l)
+        else:
+            lines.append(" ")
+
+    # 防止空文本情况
+    if max_char_in_line == 0:
+        max_char_in_line = 1
+    if len(lines) == 0:
+        lines = [" "]
+
+    # 计算字符大小（基于整个画布）
+    if layout == 'vertical':
+        char_horizontal_size = width // max(1, len(lines))
+        char_vertical_size = height // max(1, max_char_in_line)
+        char_size = min(char_horizontal_size, char_vertical_size)
+    else:
+        char_horizontal_size = width // max(1, max_char_in_line)
+        char_vertical_size = height // max(1, len(lines))
+        char_size = min(char_horizontal_size, char_vertical_size)
+
+    # 根据缩放比例调整字符大小
+    char_size = int(char_size * scale / 100)
+    spacing = int(spacing * scale / 100)
+    leading = int(leading * scale / 100)
+
+    # 主字体缺少字形时切换到回退字体，字号不变
+    def resolve_font(char, font):
+        if glyph_index is None or not hasattr(font, 'size'):
+            return font
+        fallback_file = glyph_index.resolve(font_file, char)
+        if fallback_file == font_file:
+            return font
+        return load_font(os.path.join(font_dir, fallback_file), font.size, font)
+
+    # 获取字符实际尺寸
+    def get_text_dimensions(text, font):
+        if glyph_index is not None and len(text) > 1 and not glyph_index.covers(font_file, text):
+            # 含回退字符时逐字测量
+            sizes = [get_text_dimensions(char, font) for char in text]
+            return sum(w for w, _ in sizes), max(h for _, h in sizes)
+        if len(text) == 1:
+            font = resolve_font(text, font)
+        try:
+            if hasattr(font, 'getbbox'):
+                bbox = font.getbbox(text)
+                return bbox[2] - bbox[0], bbox[3] - bbox[1]
+            else:
+                return font.getsize(text)
+        except:
+            # 如果无法获取确切尺寸，使用估算值
+            return len(text) * char_size, char_size
+
+    # 计算每行/列的实际尺寸
+    lines_dimensions = []
+    max_line_width = 0
+    total_height = 0
+
+    for line in lines:
+        font = load_font(font_path, char_size)
+
+        line_width, line_height = get_text_dimensions(line, font)
+
+        if layout == 'horizontal':
+            # 水平布局：考虑间距
+            if len(line) > 1:
+                line_width += spacing * (len(line) - 1)
+            max_line_width = max(max_line_width, line_width)
+            lines_dimensions.append((line_width, line_height))
+            total_height += line_height
+        else:
+            # 垂直布局
+            if len(line) > 1:
+                line_height += spacing * (len(line) - 1)
+            lines_dimensions.append((line_width, line_height))
+            max_line_width = max(max_line_width, line_width)
+            total_height += line_height
+
+    # 添加行间距
+    if layout == 'horizontal' and len(lines) > 1:
+        total_height += leading * (len(lines) - 1)
+
+    # 计算整个文本区域的宽高
+    text_width = max_line_width
+    text_height = total_height
+
+    # 确保文本不超出画布
+    if text_width > width:
+        # 等比缩小字体
+        scale_factor = width / text_width
+        char_size = int(char_size * scale_factor)
+        spacing = int(spacing * scale_factor)
+        leading = int(leading * scale_factor)
+
+        # 重新计算
+        lines_dimensions = []
+        max_line_width = 0
+        total_height = 0
+
+        for line in lines:
+            font = load_font(font_path, char_size)
+
+            line_width, line_height = get_text_dimensions(line, font)
+
+            if layout == 'horizontal':
+                if len(line) > 1:
+                    line_width += spacing * (len(line) - 1)
+                max_line_width = max(max_line_width, line_width)
+                lines_dimensions.append((line_width, line_height))
+                total_height += line_height
+            else:
+                if len(line) > 1:
+                    line_height += spacing * (len(line) - 1)
+                lines_dimensions.append((line_width, line_height))
+                max_line_width = max(max_line_width, line_width)
+                total_height += line_height
+
+        if layout == 'horizontal' and len(lines) > 1:
+            total_height += leading * (len(lines) - 1)
+
+        text_width = max_line_width
+        text_height = total_height
+
+    if text_height > height:
+        # 等比缩小字体
+        scale_factor = height / text_height
+        char_size = int(char_size * scale_factor)
+        spacing = int(spacing * scale_factor)
+        leading = int(leading * scale_factor)
+
+        # 重新计算
+        lines_dimensions = []
+        max_line_width = 0
+        total_height = 0
+
+        for line in lines:
+            font = load_font(font_path, char_size)
+
+            line_width, line_height = get_text_dimensions(line, font)
+
+            if layout == 'horizontal':
+                if len(line) > 1:
+                    line_width += spacing * (len(line) - 1)
+                max_line_width = max(max_line_width, line_width)
+                lines_dimensions.append((line_width, line_height))
+                total_height += line_height
+            else:
+                if len(line) > 1:
+                    line_height += spacing * (len(line) - 1)
+                lines_dimensions.append((line_width, line_height))
+                max_line_width = max(max_line_width, line_width)
+                total_height += line_height
+
+        if layout == 'horizontal' and len(lines) > 1:
+            total_height += leading * (len(lines) - 1)
+
+        text_width = max_line_width
+        text_height = total_height
+
+    # 根据对齐方式计算起始位置
+    if h_align == "left":
+        start_x = 0
+    elif h_align == "center":
+        start_x = (width - text_width) // 2
+    else:  # right
+        start_x = width - text_width
+
+    if v_align == "top":
+        start_y = 0
+    elif v_align == "center":
+        start_y = (height - text_height) // 2
+    else:  # bottom
+        start_y = height - text_height
+
+    # x_offset/y_offset 只是整体平移，在绘制阶段统一应用，便于序列帧复用排版
+
+    # 初始字符位置
+    current_x = start_x
+    current_y = start_y
+
+    # 计算每个字符的位置和大小
+    for i in range(len(lines)):
+        line_table = []
+        line_text = lines[i]
+        line_width, line_height = lines_dimensions[i]
+
+        # 创建用于当前行的字体
+        font = load_font(font_path, char_size)
+
+        # 随机变化因子
+        line_random = random_numbers(total=len(line_text),
+                                     random_range=int(char_size * variation_range / 25),
+                                     seed=variation_seed+i, sum_of_numbers=0)
+
+        # 设置行起始位置
+        if layout == 'vertical':
+            # 重新计算每个字符在垂直布局中的尺寸
+            column_width = lines_dimensions[i][0]
+            column_height = 0
+            column_chars = []
+
+            # 首先计算所有字符的高度，并存储起来
+            for j in range(len(line_text)):
+                # 应用可能的随机变化到字体大小
+                font_size_variation = 0
+                if variation_range > 0:
+                    font_size_variation = line_random[j]
+                    char_font = load_font(font_path, char_size + font_size_variation, font)
+                    char_width, char_height = get_text_dimensions(line_text[j], char_font)
+                else:
+                    char_width, char_height = get_text_dimensions(line_text[j], font)
+
+                column_chars.append((char_width, char_height))
+                column_height += char_height
+
+            # 添加字符间距到总高度
+            if len(line_text) > 1:
+                column_height += spacing * (len(line_text) - 1)
+
+            # 计算所有列的总宽度(每列宽度+列间距)
+            total_width = 0
+            for j in range(len(lines)):
+                if j < len(lines_dimensions):
+                    total_width += lines_dimensions[j][0]
+                    if j < len(lines) - 1:  # 最后一列后面不加间距
+                        total_width += spacing
+
+            # 根据水平对齐计算水平位置
+            if h_align == "center":
+                # 总宽度居中
+                base_x = (width - total_width) // 2
+            elif h_align == "right":
+                # 总宽度右对齐
+                base_x = width - total_width
+            else:  # left
+                base_x = 0
+
+            # 计算当前列的起始x位置
+            current_x = base_x
+            for j in range(i):
+                if j < len(lines_dimensions):
+                    current_x += lines_dimensions[j][0] + spacing
+
+            # 行内垂直对齐 - 不使用start_y，直接计算垂直位置
+            if v_align == "center":
+                current_y = (height - column_height) // 2
+            elif v_align == "bottom":
+                current_y = height - column_height
+            else:  # top
+                current_y = 0
+        else:
+            if i > 0:
+                current_y += lines_dimensions[i-1][1] + leading
+
+            # 行内水平对齐
+            if h_align == "center":
+                current_x = start_x + (text_width - line_width) // 2
+            elif h_align == "right":
+                current_x = start_x + text_width - line_width
+            else:  # left
+                current_x = start_x
+
+        # 绘制每个字符
+        for j in range(len(line_text)):
+            char = line_text[j]
+
+            # 单字符尺寸
+            char_width, char_height = get_text_dimensions(char, font)
+
+            # 应用随机变化
+            font_size_variation = 0
+            if variation_range > 0:
+                font_size_variation = line_random[j]
+                # 重新创建字体
+                char_font = load_font(font_path, char_size + font_size_variation, font)
+
+                # 重新计算尺寸
+                char_width, char_height = get_text_dimensions(char, char_font)
+            else:
+                char_font = font
+            char_font = resolve_font(char, char_font)
+
+            # 计算字符位置
+            if layout == 'vertical':
+                axis_x = current_x + (column_width - char_width) // 2
+            else:
+                axis_x = current_x
+
+            if variation_range > 0:
+                offset_x = int(font_size_variation * variation_range / 250)
+                offset_y = int(font_size_variation * variation_range / 250)
+                axis_x = axis_x + (offset_x if random.random() > 0.5 else -offset_x)
+                axis_y = current_y + (offset_y if random.random() > 0.5 else -offset_y)
+            else:
+                axis_y = current_y
+
+            char_dict = {'char': char,
+                        'axis': (axis_x, axis_y),
+                        'font': char_font,
+                        'size': char_size + font_size_variation}
+            line_table.append(char_dict)
+
+            # 更新下一个字符的位置
+            if layout == 'vertical':
+                if j < len(line_text) - 1:
+                    # 使用预先计算的字符高度
+                    current_y += char_height + spacing
+            else:
+                current_x += char_width + spacing
+
+        text_table.append(line_table)
+
+    return text_table
+
+def text_bbox(text_table, width, height, x_offset=0, y_offset=0):
+    """计算字符表在画布上的包围盒 (x0, y0, x1, y1)，已裁剪到画布内；没有可见字符时返回None"""
+    x0, y0, x1, y1 = width, height, 0, 0
+    for line_table in text_table:
+        for char_dict in line_table:
+            glyph, (left, top) = get_glyph(char_dict['font'], char_dict['char'])
+            if glyph is None:
+                continue
+            axis_x, axis_y = char_dict['axis']
+            x = axis_x + x_offset + left
+            y = axis_y + y_offset + top
+            x0, y0 = min(x0, x), min(y0, y)
+            x1, y1 = max(x1, x + glyph.width), max(y1, y + glyph.height)
+    x0, y0 = max(0, x0), max(0, y0)
+    x1, y1 = min(width, x1), min(height, y1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1)
+
+def render_mask(text_table, width, height, x_offset=0, y_offset=0, box=None):
+    """
+    将字符表绘制为L模式遮罩，字形位图从缓存中取出后按偏移粘贴
+
+    指定box时只绘制包围盒内的区域，返回的遮罩尺寸与box一致
+    """
+    if box is None:
+        box = (0, 0, width, height)
+    _mask = Image.new('L', size=(box[2] - box[0], box[3] - box[1]), color=0)
+    for line_table in text_table:
+        for char_dict in line_table:
+            glyph, (left, top) = get_glyph(char_dict['font'], char_dict['char'])
+            if glyph is None:
+                continue
+            axis_x, axis_y = char_dict['axis']
+            x = axis_x + x_offset + left - box[0]
+            y = axis_y + y_offset + top - box[1]
+            _mask.paste(255, (x, y, x + glyph.width, y + glyph.height), glyph)
+    return _mask
+
+def parse_color(font_color, background_color):
+    """解析字体颜色和背景颜色，返回两个RGB元组"""
+    try:
+        if isinstance(font_color, str):
+            font_color_rgb = ImageColor.getrgb(font_color)
+        else:
+            font_color_rgb = font_color
+            
+        if isinstance(background_color, str):
+            bg_color_rgb = ImageColor.getrgb(background_color)
+        else:
+            bg_color_rgb = background_color
+    except ValueError:
+        font_color_rgb = (255, 160, 0)  # 默认橙色
+        bg_color_rgb = (255, 255, 255)  # 默认白色
+    return tuple(font_color_rgb[:3]), tuple(bg_color_rgb[:3])
+
+def render_text(text, font_path, spacing, leading, frames, variation_range, layout, width, height,
+                font_color, background_color, h_align, v_align, image=None, glyph_index=None):
+    """
+    按逐帧参数生成文本图像批次
+
+    frames 为 interpolate_keyframes 的结果，每帧包含 x_offset/y_offset/scale/variation_seed。
+    传入image时把文字混合到image的每一帧上（只处理包围盒内的像素），返回 (图像, 遮罩)
+    """
+    import numpy as np
+    import torch
+
+    font_color_rgb, bg_color_rgb = parse_color(font_color, background_color)
+    frame_count = len(frames)
+
+    # 排版只依赖 scale 和 variation_seed，偏移变化的帧直接复用；参数相同的帧复用同一块遮罩
+    layouts = {}
+    regions = {}
+    mask_tensor = torch.zeros((frame_count, height, width), dtype=torch.float32)
+    frame_regions = []
+    for index, params in enumerate(frames):
+        layout_key = (params["scale"], params["variation_seed"])
+        region_key = layout_key + (params["x_offset"], params["y_offset"])
+        if region_key not in regions:
+            if layout_key not in layouts:
+                with span("TextImage", "layout", frame=index):
+                    layouts[layout_key] = layout_text(text, font_path, spacing, leading, params["scale"],
+                                                      variation_range, params["variation_seed"], layout,
+                                                      width, height, h_align, v_align, glyph_index)
+            table = layouts[layout_key]
+            with span("TextImage", "rasterize", frame=index):
+                box = text_bbox(table, width, height, params["x_offset"], params["y_offset"])
+                region = None
+                if box is not None:
+                    _mask = render_mask(table, width, height, params["x_offset"], params["y_offset"], box)
+                    region = (box, torch.from_numpy(np.array(_mask).astype(np.float32) / 255.0))
+            regions[region_key] = region
+        region = regions[region_key]
+        frame_regions.append(region)
+        if region is not None:
+            (x0, y0, x1, y1), alpha = region
+            mask_tensor[index, y0:y1, x0:x1] = alpha
+
+    with span("TextImage", "compose", frames=frame_count):
+        fg = torch.tensor(font_color_rgb, dtype=torch.float32) / 255.0
+        if image is not None:
+            # 只在包围盒内按遮罩混合字体颜色
+            image_tensor = image.clone()
+            fg = fg.to(device=image_tensor.device, dtype=image_tensor.dtype)
+            for index, region in enumerate(frame_regions):
+                if region is None:
+                    continue
+                (x0, y0, x1, y1), alpha = region
+                alpha = alpha.to(device=image_tensor.device, dtype=image_tensor.dtype).unsqueeze(-1)
+                pixels = image_tensor[index, y0:y1, x0:x1, :3]
+                pixels.mul_(1 - alpha).add_(fg * alpha)
+        else:
+            # 按遮罩混合前景色与背景色，alpha通道即遮罩
+            bg = torch.tensor(bg_color_rgb, dtype=torch.float32) / 255.0
+            rgb = bg + (fg - bg) * mask_tensor.unsqueeze(-1)
+            image_tensor = torch.cat((rgb, mask_tensor.unsqueeze(-1)), dim=-1)
+
+    return (image_tensor, mask_tensor)
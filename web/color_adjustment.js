@@ -87,10 +87,53 @@ app.registerExtension({
                     // 更新预览
                     this.updatePreview(false);
                 });
+
+                // 自动调整按钮，建议值由服务端根据全分辨率统计信息计算
+                this.addWidget("button", "自动对比度", null, () => {
+                    this.applyAutoAdjust(["brightness", "contrast"]);
+                });
+                this.addWidget("button", "自动白平衡", null, () => {
+                    this.applyAutoAdjust(["temperature", "tint"]);
+                });
                 
                 return result;
             };
 
+            // 从服务端获取统计信息并应用建议的滑块值
+            nodeType.prototype.applyAutoAdjust = async function(params) {
+                const widgetNames = {
+                    brightness: "亮度",
+                    contrast: "对比度",
+                    temperature: "色温",
+                    tint: "色调"
+                };
+                
+                try {
+                    const response = await api.fetchApi("/zero_color_adjustment/statistics", {
+                        method: "POST",
+                        body: JSON.stringify({ node_id: String(this.id) })
+                    });
+                    const data = await response.json();
+                    
+                    if (!data.success) {
+                        console.warn(`[ColorAdjustment] 无法获取统计信息: ${data.error}`);
+                        return;
+                    }
+                    
+                    params.forEach(param => {
+                        const value = data.suggestions[param];
+                        if (value === undefined) return;
+                        this[param] = value;
+                        const widget = this.widgets.find(w => w.name === widgetNames[param]);
+                        if (widget) widget.value = value;
+                    });
+                    
+                    this.updatePreview(false);
+                } catch (error) {
+                    console.error("[ColorAdjustment] 自动调整失败:", error);
+                }
+            };
+
             // 添加WebSocket设置方法
             nodeType.prototype.setupWebSocket = function() {
                 console.log(`[ColorAdjustment] 节点 ${this.id} 设置WebSocket监听`);
@@ -98,99 +141,39 @@ app.registerExtension({
                     const data = event.detail;
                     
                     if (data && data.node_id && data.node_id === this.id.toString()) {
-                        console.log(`[ColorAdjustment] 节点 ${this.id} 接收到更新数据`);
-                        if (data.image_data) {
-                            // 处理base64图像数据
-                            console.log("[ColorAdjustment] 接收到base64数据:", {
-                                nodeId: this.id,
-                                dataLength: data.image_data.length,
-                                dataPreview: data.image_data.substring(0, 50) + "...", // 只显示前50个字符
-                                isBase64: data.image_data.startsWith("data:image"),
-                                timestamp: new Date().toISOString()
-                            });
-                            
-                            // 更新滑块值
-                            if (data.brightness !== undefined) this.brightness = data.brightness;
-                            if (data.contrast !== undefined) this.contrast = data.contrast;
-                            if (data.saturation !== undefined) this.saturation = data.saturation;
-                            if (data.hue !== undefined) this.hue = data.hue;
-                            if (data.temperature !== undefined) this.temperature = data.temperature;
-                            if (data.tint !== undefined) this.tint = data.tint;
-                            if (data.gamma !== undefined) this.gamma = data.gamma;
-                            if (data.vibrance !== undefined) this.vibrance = data.vibrance;
-                            
-                            // 更新UI滑块
-                            this.widgets.forEach(w => {
-                                if (w.name === "亮度" && data.brightness !== undefined) {
-                                    w.value = data.brightness;
-                                } else if (w.name === "对比度" && data.contrast !== undefined) {
-                                    w.value = data.contrast;
-                                } else if (w.name === "饱和度" && data.saturation !== undefined) {
-                                    w.value = data.saturation;
-                                } else if (w.name === "色相" && data.hue !== undefined) {
-                                    w.value = data.hue;
-                                } else if (w.name === "色温" && data.temperature !== undefined) {
-                                    w.value = data.temperature;
-                                } else if (w.name === "色调" && data.tint !== undefined) {
-                                    w.value = data.tint;
-                                } else if (w.name === "伽马" && data.gamma !== undefined) {
-                                    w.value = data.gamma;
-                                } else if (w.name === "自然饱和度" && data.vibrance !== undefined) {
-                                    w.value = data.vibrance;
-                                }
-                            });
-                            
-                            this.loadImageFromBase64(data.image_data);
-                        } else {
-                            console.warn("[ColorAdjustment] 接收到空的图像数据");
-                        }
+                        console.log(`[ColorAdjustment] 节点 ${this.id} 接收到更新通知: ${data.width}x${data.height}`);
+                        await this.loadPreview(data.node_id);
                     }
                 });
             };
 
-            // 添加从base64加载图像的方法
-            nodeType.prototype.loadImageFromBase64 = function(base64Data) {
-                console.log(`[ColorAdjustment] 节点 ${this.id} 开始加载base64图像数据`);
-                // 创建一个新的图像对象
-                const img = new Image();
-                
-                // 当图像加载完成时
-                img.onload = () => {
-                    console.log(`[ColorAdjustment] 节点 ${this.id} 图像加载完成: ${img.width}x${img.height}`);
-                    // 创建一个临时画布来获取像素数据
+            // 以二进制方式获取预览PNG，直接从ArrayBuffer解码
+            nodeType.prototype.loadPreview = async function(nodeId) {
+                try {
+                    const response = await api.fetchApi(`/zero_color_adjustment/preview?node_id=${encodeURIComponent(nodeId)}`, {
+                        cache: "no-store"
+                    });
+                    if (!response.ok) {
+                        throw new Error(`服务器返回错误: ${response.status}`);
+                    }
+                    const buffer = await response.arrayBuffer();
+                    const bitmap = await createImageBitmap(new Blob([buffer], { type: "image/png" }));
+                    console.log(`[ColorAdjustment] 节点 ${this.id} 预览加载完成: ${bitmap.width}x${bitmap.height}, ${buffer.byteLength} 字节`);
+                    
+                    // 在临时画布上取出像素数据
                     const tempCanvas = document.createElement('canvas');
-                    tempCanvas.width = img.width;
-                    tempCanvas.height = img.height;
+                    tempCanvas.width = bitmap.width;
+                    tempCanvas.height = bitmap.height;
                     const tempCtx = tempCanvas.getContext('2d');
-                    
-                    // 在临时画布上绘制图像
-                    tempCtx.drawImage(img, 0, 0);
-                    
-                    // 获取像素数据
-                    const imageData = tempCtx.getImageData(0, 0, img.width, img.height);
-                    
-                    // 创建二维数组存储像素数据
-                    const pixelArray = [];
-                    for (let y = 0; y < img.height; y++) {
-                        const row = [];
-                        for (let x = 0; x < img.width; x++) {
-                            const idx = (y * img.width + x) * 4;
-                            row.push([
-                                imageData.data[idx],     // R
-                                imageData.data[idx + 1], // G
-                                imageData.data[idx + 2]  // B
-                            ]);
-                        }
-                        pixelArray.push(row);
-                    }
+                    tempCtx.drawImage(bitmap, 0, 0);
+                    bitmap.close();
                     
                     // 存储像素数据并更新预览
-                    this.originalImageData = pixelArray;
+                    this.originalImageData = tempCtx.getImageData(0, 0, tempCanvas.width, tempCanvas.height);
                     this.updatePreview();
-                };
-                
-                // 设置图像源
-                img.src = base64Data;
+                } catch (error) {
+                    console.error("[ColorAdjustment] 预览加载失败:", error);
+                }
             };
 
             // 添加节点时的处理
@@ -241,8 +224,8 @@ app.registerExtension({
                 
                 requestAnimationFrame(() => {
                     const ctx = this.canvas.getContext("2d");
-                    const width = this.originalImageData[0].length;
-                    const height = this.originalImageData.length;
+                    const width = this.originalImageData.width;
+                    const height = this.originalImageData.height;
                     
                     if (!onlyPreview && !this.isAdjusting) {
                         console.log(`[ColorAdjustment] 节点 ${this.id} 更新预览并准备发送数据 (${width}x${height})`);
@@ -250,19 +233,7 @@ app.registerExtension({
                         console.log(`[ColorAdjustment] 节点 ${this.id} 仅更新预览 (${width}x${height})`);
                     }
                     
-                    // 创建ImageData
-                    const imgData = new ImageData(width, height);
-                    
-                    // 填充原始数据
-                    for (let y = 0; y < height; y++) {
-                        for (let x = 0; x < width; x++) {
-                            const idx = (y * width + x) * 4;
-                            imgData.data[idx] = this.originalImageData[y][x][0];     // R
-                            imgData.data[idx + 1] = this.originalImageData[y][x][1]; // G
-                            imgData.data[idx + 2] = this.originalImageData[y][x][2]; // B
-                            imgData.data[idx + 3] = 255;                             // A
-                        }
-                    }
+                    const imgData = this.originalImageData;
                     
                     // 应用颜色调整
                     const adjustedData = this.adjustColors(imgData);
@@ -282,14 +253,14 @@ app.registerExtension({
 
             // 优化颜色调整方法，提高性能
             nodeType.prototype.adjustColors = function(imageData) {
-                const brightness = this.brightness || 1.0;
-                const contrast = this.contrast || 1.0;
-                const saturation = this.saturation || 1.0;
-                const hue = this.hue || 1.0;
-                const temperature = this.temperature || 1.0;
-                const tint = this.tint || 1.0;
-                const gamma = this.gamma || 1.0;
-                const vibrance = this.vibrance || 1.0;
+                const brightness = this.brightness ?? 1.0;
+                const contrast = this.contrast ?? 1.0;
+                const saturation = this.saturation ?? 1.0;
+                const hue = this.hue ?? 1.0;
+                const temperature = this.temperature ?? 1.0;
+                const tint = this.tint ?? 1.0;
+                const gamma = this.gamma ?? 1.0;
+                const vibrance = this.vibrance ?? 1.0;
                 
                 const result = new Uint8ClampedArray(imageData.data);
                 const len = result.length;
@@ -346,12 +317,12 @@ app.registerExtension({
                     g = g * contrastFactor + contrastOffset;
                     b = b * contrastFactor + contrastOffset;
                     
-                    // 应用伽马校正
+                    // 应用伽马校正（对比度可能使值小于0，先截断到0，避免负数取幂得到NaN）
                     if (gamma !== 1.0) {
                         const invGamma = 1.0 / gamma;
-                        r = Math.pow(r / 255, invGamma) * 255;
-                        g = Math.pow(g / 255, invGamma) * 255;
-                        b = Math.pow(b / 255, invGamma) * 255;
+                        r = Math.pow(Math.max(0, r) / 255, invGamma) * 255;
+                        g = Math.pow(Math.max(0, g) / 255, invGamma) * 255;
+                        b = Math.pow(Math.max(0, b) / 255, invGamma) * 255;
                     }
                     
                     // 优化饱和度调整 - 使用更准确的亮度权重
@@ -390,20 +361,18 @@ app.registerExtension({
                 return new ImageData(result, imageData.width, imageData.height);
             };
 
-            // 添加发送调整后数据的方法，优化为异步
+            // 添加发送调整后数据的方法，以原始RGBA字节提交
             nodeType.prototype.sendAdjustedData = async function(adjustedData) {
                 try {
-                    const endpoint = '/color_adjustment/apply';
                     const nodeId = String(this.id);
+                    const endpoint = `/zero_color_adjustment/apply?node_id=${encodeURIComponent(nodeId)}`;
                     
                     api.fetchApi(endpoint, {
                         method: 'POST',
-                        body: JSON.stringify({
-                            node_id: nodeId,
-                            adjusted_data: Array.from(adjustedData.data),
-                            width: adjustedData.width,
-                            height: adjustedData.height
-                        })
+                        headers: {
+                            'Content-Type': 'application/octet-stream'
+                        },
+                        body: adjustedData.data.buffer
                     }).then(response => {
                         if (!response.ok) {
                             throw new Error(`服务器返回错误: ${response.status}`);
@@ -14,7 +14,6 @@ function createCropperModal() {
             <div class="cropper-content">
                 <div class="cropper-wrapper">
                     <canvas id="crop-canvas"></canvas>
-                    <div class="crop-selection"></div>
                 </div>
                 <div class="cropper-controls">
                     <button id="apply-crop">应用裁剪</button>
@@ -88,17 +87,7 @@ style.textContent = `
     }
     
     #crop-canvas {
-        max-width: 100%;
-        max-height: 70vh;
-        object-fit: contain; /* 保持比例 */
-    }
-    
-    .crop-selection {
-        position: absolute;
-        border: 2px solid #00ff00;
-        background: rgba(0, 255, 0, 0.1);
-        pointer-events: none;
-        transform-origin: 0 0; /* 添加变换原点 */
+        cursor: crosshair;
     }
     
     .cropper-controls {
@@ -126,17 +115,22 @@ style.textContent = `
 `;
 document.head.appendChild(style);
 
+// 前端瓦片缓存上限（个），超出后丢弃最久未使用的瓦片
+const TILE_CACHE_LIMIT = 256;
+// 最大放大倍数（屏幕像素/图像像素）
+const MAX_VIEW_SCALE = 8;
+
 // 裁剪功能类
 class ImageCropper {
     constructor() {
         this.modal = createCropperModal();
         this.canvas = this.modal.querySelector("#crop-canvas");
         this.ctx = this.canvas.getContext("2d");
-        this.selection = this.modal.querySelector(".crop-selection");
         
         this.isDrawing = false;
-        this.startX = 0;
-        this.startY = 0;
+        this.isPanning = false;
+        this.selectionRect = null;  // 图像坐标系下的选择区域
+        this.tiles = new Map();     // "level/x/y" -> { bitmap }，bitmap为null表示正在加载
         
         this.hasFixedSeed = false;
         
@@ -173,17 +167,13 @@ class ImageCropper {
             }
         });
         
-        // 画布鼠标事件
+        // 画布鼠标事件：左键框选，中键/右键拖动平移，滚轮缩放
         this.canvas.addEventListener("mousedown", (e) => this.startDrawing(e));
         this.canvas.addEventListener("mousemove", (e) => this.draw(e));
         this.canvas.addEventListener("mouseup", () => this.endDrawing());
-        
-        // 添加调试日志
-        console.log("事件监听器已设置:", {
-            closeButton: !!closeButton,
-            cancelButton: !!cancelButton,
-            applyButton: !!applyButton
-        });
+        this.canvas.addEventListener("mouseleave", () => this.endDrawing());
+        this.canvas.addEventListener("wheel", (e) => this.zoom(e), { passive: false });
+        this.canvas.addEventListener("contextmenu", (e) => e.preventDefault());
     }
     
     async cleanupAndClose(cancelled = false) {
@@ -204,13 +194,6 @@ class ImageCropper {
             }
         }
         
-        // 清理选择框
-        if (this.selection) {
-            this.selection.style.display = 'none';
-            this.selection.style.width = '0';
-            this.selection.style.height = '0';
-        }
-        
         // 清理画布
         if (this.ctx) {
             this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
@@ -218,100 +201,220 @@ class ImageCropper {
         
         // 重置状态
         this.isDrawing = false;
-        this.startX = 0;
-        this.startY = 0;
+        this.isPanning = false;
+        this.selectionRect = null;
+        this.clearTiles();
         
         // 关闭窗口
         this.modal.close();
     }
     
-    startDrawing(e) {
+    // 画布坐标 -> 图像坐标
+    toImageCoords(e) {
         const rect = this.canvas.getBoundingClientRect();
-        this.isDrawing = true;
-        this.startX = e.clientX - rect.left;
-        this.startY = e.clientY - rect.top;
+        const cx = (e.clientX - rect.left) * this.canvas.width / rect.width;
+        const cy = (e.clientY - rect.top) * this.canvas.height / rect.height;
+        return {
+            cx, cy,
+            x: Math.min(this.imageWidth, Math.max(0, this.viewX + cx / this.viewScale)),
+            y: Math.min(this.imageHeight, Math.max(0, this.viewY + cy / this.viewScale))
+        };
+    }
+    
+    startDrawing(e) {
+        const point = this.toImageCoords(e);
+        if (e.button === 1 || e.button === 2) {
+            this.isPanning = true;
+            this.panStart = { cx: point.cx, cy: point.cy, viewX: this.viewX, viewY: this.viewY };
+            return;
+        }
         
-        this.selection.style.left = `${this.startX}px`;
-        this.selection.style.top = `${this.startY}px`;
-        this.selection.style.width = "0px";
-        this.selection.style.height = "0px";
-        this.selection.style.display = "block";
+        this.isDrawing = true;
+        this.startX = point.x;
+        this.startY = point.y;
+        this.selectionRect = { x: point.x, y: point.y, width: 0, height: 0 };
+        this.render();
     }
     
     draw(e) {
+        const point = this.toImageCoords(e);
+        if (this.isPanning) {
+            this.viewX = this.panStart.viewX - (point.cx - this.panStart.cx) / this.viewScale;
+            this.viewY = this.panStart.viewY - (point.cy - this.panStart.cy) / this.viewScale;
+            this.clampView();
+            this.render();
+            return;
+        }
         if (!this.isDrawing) return;
         
-        const rect = this.canvas.getBoundingClientRect();
-        const currentX = e.clientX - rect.left;
-        const currentY = e.clientY - rect.top;
-        
-        const width = currentX - this.startX;
-        const height = currentY - this.startY;
-        
-        this.selection.style.width = `${Math.abs(width)}px`;
-        this.selection.style.height = `${Math.abs(height)}px`;
-        this.selection.style.left = `${width < 0 ? currentX : this.startX}px`;
-        this.selection.style.top = `${height < 0 ? currentY : this.startY}px`;
+        this.selectionRect = {
+            x: Math.min(point.x, this.startX),
+            y: Math.min(point.y, this.startY),
+            width: Math.abs(point.x - this.startX),
+            height: Math.abs(point.y - this.startY)
+        };
+        this.render();
     }
     
     endDrawing() {
         this.isDrawing = false;
+        this.isPanning = false;
+    }
+    
+    zoom(e) {
+        e.preventDefault();
+        const point = this.toImageCoords(e);
+        const factor = e.deltaY < 0 ? 1.25 : 0.8;
+        const scale = Math.min(MAX_VIEW_SCALE, Math.max(this.fitScale, this.viewScale * factor));
+        
+        // 保持鼠标下的图像位置不变
+        this.viewX = point.x - point.cx / scale;
+        this.viewY = point.y - point.cy / scale;
+        this.viewScale = scale;
+        this.clampView();
+        this.render();
+    }
+    
+    clampView() {
+        const viewWidth = this.canvas.width / this.viewScale;
+        const viewHeight = this.canvas.height / this.viewScale;
+        this.viewX = Math.min(Math.max(0, this.viewX), Math.max(0, this.imageWidth - viewWidth));
+        this.viewY = Math.min(Math.max(0, this.viewY), Math.max(0, this.imageHeight - viewHeight));
+    }
+    
+    // 当前缩放下分辨率足够的最粗层级
+    levelForScale(scale) {
+        const level = Math.floor(Math.log2(1 / scale));
+        return Math.min(this.levels - 1, Math.max(0, level));
+    }
+    
+    render() {
+        if (this.renderPending) return;
+        this.renderPending = true;
+        requestAnimationFrame(() => {
+            this.renderPending = false;
+            this.renderNow();
+        });
     }
     
-    calculateScale() {
-        const canvas = this.canvas;
-        const wrapper = canvas.parentElement;
+    renderNow() {
+        if (!this.imageWidth) return;
         
-        // 获取实际显示尺寸
-        const displayRect = canvas.getBoundingClientRect();
+        const ctx = this.ctx;
+        ctx.fillStyle = "#1a1a1a";
+        ctx.fillRect(0, 0, this.canvas.width, this.canvas.height);
         
-        // 计算缩放比例
-        this.scaleX = canvas.width / displayRect.width;
-        this.scaleY = canvas.height / displayRect.height;
+        // 先绘制已缓存的粗层级作为占位，再绘制并请求当前层级
+        const level = this.levelForScale(this.viewScale);
+        for (let l = this.levels - 1; l > level; l--) {
+            this.drawLevel(l, false);
+        }
+        this.drawLevel(level, true);
         
-        console.log("缩放比例:", {
-            scaleX: this.scaleX,
-            scaleY: this.scaleY,
-            canvasWidth: canvas.width,
-            canvasHeight: canvas.height,
-            displayWidth: displayRect.width,
-            displayHeight: displayRect.height
-        });
+        if (this.selectionRect) {
+            const rect = this.selectionRect;
+            const x = (rect.x - this.viewX) * this.viewScale;
+            const y = (rect.y - this.viewY) * this.viewScale;
+            const width = rect.width * this.viewScale;
+            const height = rect.height * this.viewScale;
+            ctx.fillStyle = "rgba(0, 255, 0, 0.1)";
+            ctx.fillRect(x, y, width, height);
+            ctx.strokeStyle = "#00ff00";
+            ctx.lineWidth = 2;
+            ctx.strokeRect(x, y, width, height);
+        }
+    }
+    
+    drawLevel(level, request) {
+        const factor = 2 ** level;
+        const span = this.tileSize * factor;  // 单个瓦片覆盖的原图像素
+        const columns = Math.ceil(this.imageWidth / span);
+        const rows = Math.ceil(this.imageHeight / span);
+        
+        const x0 = Math.max(0, Math.floor(this.viewX / span));
+        const y0 = Math.max(0, Math.floor(this.viewY / span));
+        const x1 = Math.min(columns - 1, Math.floor((this.viewX + this.canvas.width / this.viewScale) / span));
+        const y1 = Math.min(rows - 1, Math.floor((this.viewY + this.canvas.height / this.viewScale) / span));
+        
+        for (let ty = y0; ty <= y1; ty++) {
+            for (let tx = x0; tx <= x1; tx++) {
+                const key = `${level}/${tx}/${ty}`;
+                const tile = this.tiles.get(key);
+                if (tile && tile.bitmap) {
+                    // 重新插入以维持LRU顺序
+                    this.tiles.delete(key);
+                    this.tiles.set(key, tile);
+                    this.ctx.drawImage(tile.bitmap,
+                        (tx * span - this.viewX) * this.viewScale,
+                        (ty * span - this.viewY) * this.viewScale,
+                        tile.bitmap.width * factor * this.viewScale,
+                        tile.bitmap.height * factor * this.viewScale
+                    );
+                } else if (!tile && request) {
+                    this.loadTile(level, tx, ty);
+                }
+            }
+        }
+    }
+    
+    // 以二进制方式获取瓦片PNG，直接从ArrayBuffer解码
+    async loadTile(level, x, y) {
+        const key = `${level}/${x}/${y}`;
+        const nodeId = this.currentNodeId;
+        const session = this.currentSession;
+        const tile = { bitmap: null };
+        this.tiles.set(key, tile);
+        
+        while (this.tiles.size > TILE_CACHE_LIMIT) {
+            const oldest = this.tiles.keys().next().value;
+            this.tiles.get(oldest).bitmap?.close();
+            this.tiles.delete(oldest);
+        }
+        
+        try {
+            const response = await api.fetchApi(
+                `/zero_image_cropper/tile?node_id=${encodeURIComponent(nodeId)}&session=${encodeURIComponent(session)}&level=${level}&x=${x}&y=${y}`,
+                { cache: "no-store" }
+            );
+            if (!response.ok) {
+                throw new Error(`服务器返回错误: ${response.status}`);
+            }
+            const buffer = await response.arrayBuffer();
+            const bitmap = await createImageBitmap(new Blob([buffer], { type: "image/png" }));
+            
+            // 加载期间窗口已切换或瓦片已被淘汰
+            if (session !== this.currentSession || this.tiles.get(key) !== tile) {
+                bitmap.close();
+                return;
+            }
+            tile.bitmap = bitmap;
+            this.render();
+        } catch (error) {
+            if (this.tiles.get(key) === tile) this.tiles.delete(key);
+        }
+    }
+    
+    clearTiles() {
+        this.tiles.forEach(tile => tile.bitmap?.close());
+        this.tiles.clear();
     }
     
     async applyCrop() {
+        const rect = this.selectionRect;
+        
         // 检查是否有选择区域
-        if (!this.selection || 
-            !this.selection.style.width || 
-            !this.selection.style.height ||
-            parseInt(this.selection.style.width) <= 0 ||
-            parseInt(this.selection.style.height) <= 0) {
+        if (!rect || rect.width < 1 || rect.height < 1) {
             console.warn("未选择有效的裁剪区域");
             this.cleanupAndClose();
             return;
         }
-
-        const rect = this.selection.getBoundingClientRect();
-        const canvasRect = this.canvas.getBoundingClientRect();
         
-        // 计算实际坐标（考虑缩放）
-        let x = (rect.left - canvasRect.left) * this.scaleX;
-        let y = (rect.top - canvasRect.top) * this.scaleY;
-        let width = rect.width * this.scaleX;
-        let height = rect.height * this.scaleY;
-
-        console.log("裁剪参数:", {
-            x, y, width, height,
-            originalRect: rect,
-            canvasRect: canvasRect
-        });
-
-        // 确保坐标和尺寸在有效范围内
-        x = Math.max(0, Math.min(x, this.canvas.width));
-        y = Math.max(0, Math.min(y, this.canvas.height));
-        width = Math.min(width, this.canvas.width - x);
-        height = Math.min(height, this.canvas.height - y);
-
+        // 图像坐标系下的裁剪区域，确保在有效范围内
+        const x = Math.max(0, Math.min(Math.round(rect.x), this.imageWidth - 1));
+        const y = Math.max(0, Math.min(Math.round(rect.y), this.imageHeight - 1));
+        const width = Math.min(Math.round(rect.width), this.imageWidth - x);
+        const height = Math.min(Math.round(rect.height), this.imageHeight - y);
+        
         // 检查最终尺寸是否有效
         if (width <= 0 || height <= 0) {
             console.error("裁剪区域无效");
@@ -320,44 +423,7 @@ class ImageCropper {
         }
         
         try {
-            // 创建临时画布进行裁剪
-            const tempCanvas = document.createElement("canvas");
-            tempCanvas.width = width;
-            tempCanvas.height = height;
-            const tempCtx = tempCanvas.getContext("2d");
-            
-            // 添加错误处理
-            try {
-                tempCtx.drawImage(this.canvas, 
-                    x, y, width, height,
-                    0, 0, width, height
-                );
-            } catch (drawError) {
-                console.error("裁剪绘制失败:", drawError);
-                this.cleanupAndClose();
-                return;
-            }
-            
-            // 转换为base64
-            let croppedImage;
-            try {
-                croppedImage = tempCanvas.toDataURL("image/png");
-            } catch (dataUrlError) {
-                console.error("图像转换失败:", dataUrlError);
-                this.cleanupAndClose();
-                return;
-            }
-            
-            console.log("准备发送请求，参数:", {
-                node_id: this.currentNodeId,
-                width: Math.round(width),
-                height: Math.round(height),
-                x: Math.round(x),
-                y: Math.round(y),
-                imageLength: croppedImage.length
-            });
-
-            // 简化请求处理
+            // 只发送裁剪坐标，由后端在原图上裁剪
             await api.fetchApi("/zero_image_cropper/apply", {
                 method: "POST",
                 headers: {
@@ -365,11 +431,10 @@ class ImageCropper {
                 },
                 body: JSON.stringify({
                     node_id: this.currentNodeId,
-                    width: Math.round(width),
-                    height: Math.round(height),
-                    x: Math.round(x),
-                    y: Math.round(y),
-                    cropped_data_base64: croppedImage,
+                    width,
+                    height,
+                    x,
+                    y
                 })
             });
             
@@ -382,21 +447,30 @@ class ImageCropper {
         }
     }
     
-    show(nodeId, imageData, node) {
+    show(nodeId, info, node) {
         this.currentNodeId = nodeId;
+        this.currentSession = info.session;  // 本次执行的会话令牌，瓦片请求需要携带
         this.currentNode = node;
         
-        const img = new Image();
-        img.onload = () => {
-            this.canvas.width = img.width;
-            this.canvas.height = img.height;
-            this.ctx.drawImage(img, 0, 0);
-            this.modal.showModal();
-            
-            // 计算初始缩放比例
-            this.calculateScale();
-        };
-        img.src = imageData;
+        this.imageWidth = info.width;
+        this.imageHeight = info.height;
+        this.tileSize = info.tile_size;
+        this.levels = info.levels;
+        this.clearTiles();
+        this.selectionRect = null;
+        
+        // 画布按窗口大小显示整张图像，之后可滚轮放大
+        const maxWidth = window.innerWidth * 0.8;
+        const maxHeight = window.innerHeight * 0.7;
+        this.fitScale = Math.min(maxWidth / info.width, maxHeight / info.height, 1);
+        this.canvas.width = Math.max(1, Math.round(info.width * this.fitScale));
+        this.canvas.height = Math.max(1, Math.round(info.height * this.fitScale));
+        this.viewScale = this.fitScale;
+        this.viewX = 0;
+        this.viewY = 0;
+        
+        this.modal.showModal();
+        this.render();
     }
 }
 
@@ -408,9 +482,8 @@ app.registerExtension({
         
         // 监听裁剪更新事件
         api.addEventListener("zero_image_cropper_update", ({ detail }) => {
-            const { node_id, image_data } = detail;
-            const node = app.graph.getNodeById(node_id);
-            cropper.show(node_id, image_data, node);
+            const node = app.graph.getNodeById(detail.node_id);
+            cropper.show(detail.node_id, detail, node);
         });
     },
     